@@ -0,0 +1,207 @@
+# backend/antworten.py
+"""
+Antwortformat und -kompression.
+
+- `KompressionMiddleware`: Brotli oder gzip nach `Accept-Encoding`.
+  Kleine Antworten (< KOMPRESSION_MIN_BYTES) gehen unkomprimiert raus, weil dort der CPU-Aufwand
+  den Übertragungsgewinn übersteigt; sehr große mit niedriger Stufe. Gestreamte Antworten werden
+  chunkweise komprimiert (kein Puffern des ganzen Bodys), SSE (`text/event-stream`) gar nicht.
+  Die Kompressionszeit steht im `Server-Timing`-Header (`kompression;dur=<ms>`).
+- `VerhandeltesJSON`: Response-Klasse für Listen/Berichte; liefert MessagePack, wenn der Client
+  es per `Accept` bevorzugt, sonst JSON.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+import zlib
+from contextvars import ContextVar
+from typing import Any, Optional
+
+import brotli
+import msgpack
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+log = logging.getLogger(__name__)
+
+KOMPRESSION_MIN_BYTES = 1024
+KOMPRESSION_GROSS_BYTES = 4 * 1024 * 1024  # ab hier schnellste Stufe
+GZIP_STUFE, GZIP_STUFE_SCHNELL = 5, 1
+BROTLI_QUALITAET, BROTLI_QUALITAET_SCHNELL = 4, 1
+NICHT_KOMPRIMIEREN = ("text/event-stream", "image/", "application/zip", "application/gzip")
+
+MSGPACK_TYPEN = ("application/msgpack", "application/x-msgpack")
+
+
+def _qwerte(header: str) -> dict[str, float]:
+    """`Accept`/`Accept-Encoding` -> {wert: q}; Einträge mit q=0 fallen weg."""
+    werte: dict[str, float] = {}
+    for teil in header.split(","):
+        wert, _, params = teil.strip().partition(";")
+        if not wert:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            werte[wert.strip().lower()] = q
+    return werte
+
+
+# ---------- Kompression ----------
+class _Kompressor:
+    def __init__(self, verfahren: str, schnell: bool) -> None:
+        self.verfahren = verfahren
+        if verfahren == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITAET_SCHNELL if schnell else BROTLI_QUALITAET)
+        else:
+            self._obj = zlib.compressobj(GZIP_STUFE_SCHNELL if schnell else GZIP_STUFE, zlib.DEFLATED, 31)
+        self.sekunden = 0.0
+
+    def weiter(self, daten: bytes) -> bytes:
+        t = time.perf_counter()
+        out = self._obj.process(daten) if self.verfahren == "br" else self._obj.compress(daten)
+        self.sekunden += time.perf_counter() - t
+        return out
+
+    def ende(self) -> bytes:
+        t = time.perf_counter()
+        out = self._obj.finish() if self.verfahren == "br" else self._obj.flush()
+        self.sekunden += time.perf_counter() - t
+        return out
+
+
+def _verfahren_waehlen(accept_encoding: str) -> Optional[str]:
+    werte = _qwerte(accept_encoding)
+    if "br" in werte:
+        return "br"
+    if "gzip" in werte or "*" in werte:
+        return "gzip"
+    return None
+
+
+class KompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum: int = KOMPRESSION_MIN_BYTES) -> None:
+        self.app = app
+        self.minimum = minimum
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        verfahren = _verfahren_waehlen(Headers(scope=scope).get("accept-encoding", ""))
+        if verfahren is None:
+            await self.app(scope, receive, send)
+            return
+        await _KomprimierteAntwort(self.app, verfahren, self.minimum)(scope, receive, send)
+
+
+class _KomprimierteAntwort:
+    def __init__(self, app: ASGIApp, verfahren: str, minimum: int) -> None:
+        self.app = app
+        self.verfahren = verfahren
+        self.minimum = minimum
+        self.start: Optional[Message] = None
+        self.kompressor: Optional[_Kompressor] = None
+        self.durchreichen = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self._senden)
+
+    async def _senden(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            typ = headers.get("content-type", "")
+            self.durchreichen = "content-encoding" in headers or typ.startswith(NICHT_KOMPRIMIEREN)
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        mehr = message.get("more_body", False)
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=start["headers"])
+            if self.durchreichen or (not mehr and len(body) < self.minimum):
+                if not self.durchreichen:
+                    headers.add_vary_header("Accept-Encoding")
+                self.durchreichen = True
+                await self.send(start)
+                await self.send(message)
+                return
+
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.verfahren
+            self.kompressor = _Kompressor(self.verfahren, schnell=len(body) >= KOMPRESSION_GROSS_BYTES)
+            if not mehr:
+                # vollständiger Body: einmal komprimieren, Länge und Zeit sind vorab bekannt
+                daten = self.kompressor.weiter(body) + self.kompressor.ende()
+                headers["Content-Length"] = str(len(daten))
+                headers.append("Server-Timing", f"kompression;dur={self.kompressor.sekunden * 1000:.2f}")
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": daten})
+                return
+            # Streaming: Länge unbekannt, chunkweise komprimieren
+            del headers["Content-Length"]
+            await self.send(start)
+
+        if self.durchreichen:
+            await self.send(message)
+            return
+        daten = self.kompressor.weiter(body)
+        if not mehr:
+            daten += self.kompressor.ende()
+            log.debug("%s-Stream komprimiert in %.2f ms", self.verfahren, self.kompressor.sekunden * 1000)
+        await self.send({"type": "http.response.body", "body": daten, "more_body": mehr})
+
+
+# ---------- MessagePack ----------
+_msgpack_gewuenscht: ContextVar[bool] = ContextVar("msgpack_gewuenscht", default=False)
+
+
+class FormatMiddleware:
+    """Merkt sich pro Request, ob der Client MessagePack vor JSON bevorzugt."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        werte = _qwerte(Headers(scope=scope).get("accept", ""))
+        q_msgpack = max((werte.get(t, 0.0) for t in MSGPACK_TYPEN), default=0.0)
+        q_json = werte.get("application/json", 0.0)
+        token = _msgpack_gewuenscht.set(q_msgpack > 0 and q_msgpack >= q_json)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _msgpack_gewuenscht.reset(token)
+
+
+class VerhandeltesJSON(JSONResponse):
+    """JSON oder MessagePack je nach `Accept` (siehe FormatMiddleware)."""
+
+    def __init__(self, content: Any, *args, **kwargs) -> None:
+        super().__init__(content, *args, **kwargs)
+        self.headers.add_vary_header("Accept")
+
+    def render(self, content: Any) -> bytes:
+        if _msgpack_gewuenscht.get():
+            self.media_type = MSGPACK_TYPEN[0]
+            return msgpack.packb(content, use_bin_type=True)
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
@@ -0,0 +1,142 @@
+# backend/archiv.py
+"""
+Archivierung: hält die heißen Tabellen klein.
+
+Verschoben werden (set-basiert, je Batch eine Transaktion):
+- abgeschlossene/stornierte Vermietungen, deren Ende vor dem Stichtag liegt und die keine offene
+  Rechnung haben, samt Positionen und Rechnungen;
+- ausgemusterte Geräte ohne (heiße) Vermietungen, samt Wartungen und Zählerständen.
+
+Je Tabelle ein Statement: DELETE ... RETURNING als CTE, daraus INSERT INTO *_archiv.
+Die Kandidaten werden mit FOR UPDATE SKIP LOCKED gewählt; gerade bearbeitete Zeilen bleiben
+für den nächsten Lauf liegen.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+from sqlalchemy import Table, delete, exists, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from . import models as m
+
+ARCHIV_BATCH = 1000
+
+
+def _verschieben(db: Session, quelle: Table, ziel: Table, bedingung) -> list[int]:
+    spalten = [c.name for c in quelle.columns]
+    verschoben = delete(quelle).where(bedingung).returning(*quelle.columns).cte("verschoben")
+    stmt = (
+        insert(ziel)
+        .from_select(spalten, select(*[verschoben.c[n] for n in spalten]))
+        .returning(ziel.c.id)
+    )
+    return list(db.scalars(stmt))
+
+
+def _protokollieren(db: Session, entitaet: str, ids: list[int]) -> None:
+    if ids:
+        db.execute(
+            insert(m.Ereignis),
+            [{"entitaet": entitaet, "entitaet_id": i, "aktion": m.EreignisAktion.ARCHIVIERT.value} for i in ids],
+        )
+
+
+def _vermietungen_archivieren(db: Session, stichtag: date, batch: int) -> dict[str, int]:
+    V, P, R = m.Vermietung, m.VermietungPosition, m.Rechnung
+    offene_rechnung = exists().where(R.vermietung_id == V.id, R.bezahlt.is_(False))
+    kandidaten = (
+        select(V.id)
+        .where(
+            V.status.in_([m.VermietStatus.GESCHLOSSEN, m.VermietStatus.STORNIERT]),
+            func.coalesce(V.bis, V.von) < stichtag,
+            ~offene_rechnung,
+        )
+        .order_by(V.id)
+        .limit(batch)
+        .with_for_update(of=V, skip_locked=True)
+    )
+    ids = list(db.scalars(kandidaten))
+    if not ids:
+        return {}
+    res = {
+        "vermietung_positionen": _verschieben(db, P.__table__, m.vermietung_positionen_archiv, P.vermietung_id.in_(ids)),
+        "rechnungen": _verschieben(db, R.__table__, m.rechnungen_archiv, R.vermietung_id.in_(ids)),
+        "vermietungen": _verschieben(db, V.__table__, m.vermietungen_archiv, V.id.in_(ids)),
+    }
+    for entitaet, moved in res.items():
+        _protokollieren(db, entitaet, moved)
+    return {k: len(v) for k, v in res.items()}
+
+
+def _geraete_archivieren(db: Session, batch: int) -> dict[str, int]:
+    G, V, W, Z = m.Geraet, m.Vermietung, m.Wartung, m.Zaehlerstand
+    kandidaten = (
+        select(G.id)
+        .where(G.status == m.GeraetStatus.AUSGEMUSTERT, ~exists().where(V.geraet_id == G.id))
+        .order_by(G.id)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+    )
+    ids = list(db.scalars(kandidaten))
+    if not ids:
+        return {}
+    res = {
+        "wartungen": _verschieben(db, W.__table__, m.wartungen_archiv, W.geraet_id.in_(ids)),
+        "zaehlerstaende": _verschieben(db, Z.__table__, m.zaehlerstaende_archiv, Z.geraet_id.in_(ids)),
+        "geraete": _verschieben(db, G.__table__, m.geraete_archiv, G.id.in_(ids)),
+    }
+    for entitaet, moved in res.items():
+        _protokollieren(db, entitaet, moved)
+    return {k: len(v) for k, v in res.items()}
+
+
+def archivieren(db: Session, stichtag: date, batch: int = ARCHIV_BATCH) -> dict[str, int]:
+    """Archiviert alles Fällige in Batches; liefert die Anzahl verschobener Zeilen je Tabelle."""
+    gesamt: dict[str, int] = {}
+
+    def _zaehlen(anzahl: dict[str, int]) -> bool:
+        db.commit()
+        for k, v in anzahl.items():
+            gesamt[k] = gesamt.get(k, 0) + v
+        return bool(anzahl)
+
+    while _zaehlen(_vermietungen_archivieren(db, stichtag, batch)):
+        pass
+    # danach: ausgemusterte Geräte, deren letzte Vermietungen gerade archiviert wurden, sind frei
+    while _zaehlen(_geraete_archivieren(db, batch)):
+        pass
+    return gesamt
+
+
+def firma_loeschen(db: Session, firma_id: int) -> None:
+    """
+    Firma mit Geräten, Wartungen und Zählerständen set-basiert löschen (statt ORM-Cascade Zeile
+    für Zeile). Geräte mit Vermietungen -> ValueError; Vermietungsdaten werden nie mitgelöscht.
+    Commit macht der Aufrufer.
+    """
+    G, V = m.Geraet.__table__, m.Vermietung.__table__
+    W, Z = m.Wartung.__table__, m.Zaehlerstand.__table__
+    geraete = select(G.c.id).where(G.c.firma_id == firma_id)
+    if db.scalar(select(exists().where(V.c.geraet_id.in_(geraete)))):
+        raise ValueError("Firma hat Geräte mit Vermietungen und kann nicht gelöscht werden")
+
+    geloescht = m.EreignisAktion.GELOESCHT.value
+    db.execute(
+        insert(m.Ereignis).from_select(
+            ["entitaet", "entitaet_id", "aktion"],
+            select(literal("geraete"), G.c.id, literal(geloescht)).where(G.c.firma_id == firma_id),
+        )
+    )
+    # Wartungen sind Sync-Entität: Tombstones auch für sie
+    db.execute(
+        insert(m.Ereignis).from_select(
+            ["entitaet", "entitaet_id", "aktion"],
+            select(literal("wartungen"), W.c.id, literal(geloescht)).where(W.c.geraet_id.in_(geraete)),
+        )
+    )
+    db.add(m.Ereignis(entitaet="firmen", entitaet_id=firma_id, aktion=geloescht))
+    db.execute(delete(W).where(W.c.geraet_id.in_(geraete)))
+    db.execute(delete(Z).where(Z.c.geraet_id.in_(geraete)))
+    db.execute(delete(G).where(G.c.firma_id == firma_id))
+    db.execute(delete(m.Firma.__table__).where(m.Firma.__table__.c.id == firma_id))
@@ -0,0 +1,98 @@
+# backend/ereignisse.py
+"""
+Änderungsprotokoll (transaktionale Outbox).
+
+Jeder Schreib-Endpunkt hängt mit `protokolliere` eine kompakte Zeile an `ereignisse` an, bevor er
+committet; Änderung und Ereignis werden also gemeinsam sichtbar oder gar nicht.
+
+Feed-Reihenfolge: Sequenz-IDs werden bei INSERT vergeben, nicht beim Commit. Eine Transaktion mit
+kleinerer ID kann also nach einer mit größerer ID sichtbar werden. Der Feed liefert deshalb nur
+Ereignisse aus Transaktionen unterhalb des xmin des aktuellen Snapshots (alle davor sind
+abgeschlossen) und ordnet nach (txid, id). Der Cursor "<txid>-<id>" ist damit lückenlos.
+"""
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+from . import models as m
+
+# Felder, die Konsumenten (Caches, Belegung, externe Systeme) ohne Nachladen brauchen
+_KERNFELDER: dict[str, tuple[str, ...]] = {
+    "geraete": ("status", "standort_typ", "mietpark_id", "firma_id"),
+    "vermietungen": ("geraet_id", "kunde_id", "status", "von", "bis"),
+    "vermietung_positionen": ("vermietung_id",),
+    "rechnungen": ("vermietung_id", "bezahlt"),
+    "wartungen": ("geraet_id", "datum"),
+    "zaehlerstaende": ("geraet_id", "stunden"),
+    "wartungsintervalle": ("kategorie",),
+}
+
+
+def protokolliere(
+    db: Session,
+    obj: Any,
+    aktion: m.EreignisAktion,
+    daten: Optional[dict] = None,
+) -> m.Ereignis:
+    """Ereignis zu `obj` in der laufenden Transaktion anlegen (Commit macht der Aufrufer)."""
+    if obj.id is None:
+        db.flush()  # ID für neue Objekte
+    if daten is None:
+        felder = _KERNFELDER.get(obj.__tablename__, ())
+        daten = jsonable_encoder({f: getattr(obj, f) for f in felder}) or None
+    e = m.Ereignis(entitaet=obj.__tablename__, entitaet_id=obj.id, aktion=aktion.value, daten=daten)
+    db.add(e)
+    return e
+
+
+def cursor_lesen(after: str) -> tuple[int, int]:
+    try:
+        txid, eid = after.split("-", 1)
+        return int(txid), int(eid)
+    except ValueError:
+        raise ValueError("Ungültiger Cursor")
+
+
+def cursor_text(txid: int, eid: int) -> str:
+    return f"{txid}-{eid}"
+
+
+def ereignisse_kopf(db: Session) -> Optional[str]:
+    """Cursor des neuesten abgeschlossenen Ereignisses (None = Protokoll leer)."""
+    E = m.Ereignis
+    stmt = (
+        select(E.txid, E.id)
+        .where(E.txid < func.txid_snapshot_xmin(func.txid_current_snapshot()))
+        .order_by(E.txid.desc(), E.id.desc())
+        .limit(1)
+    )
+    row = db.execute(stmt).first()
+    return cursor_text(row.txid, row.id) if row else None
+
+
+def ereignisse_seit(db: Session, after: Optional[str] = None, limit: int = 500):
+    E = m.Ereignis
+    abgeschlossen_bis = func.txid_snapshot_xmin(func.txid_current_snapshot())
+    stmt = select(E).where(E.txid < abgeschlossen_bis)
+    if after:
+        stmt = stmt.where(tuple_(E.txid, E.id) > tuple_(*cursor_lesen(after)))
+    stmt = stmt.order_by(E.txid, E.id).limit(limit)
+    items = db.scalars(stmt).all()
+    cursor = cursor_text(items[-1].txid, items[-1].id) if items else after
+    return {"items": items, "cursor": cursor}
+
+
+def aenderungen_seit(db: Session, after: Optional[str], entitaeten: tuple[str, ...]) -> bool:
+    """Gibt es abgeschlossene Ereignisse zu `entitaeten` nach `after` (None = überhaupt)?"""
+    E = m.Ereignis
+    stmt = select(E.id).where(
+        E.entitaet.in_(entitaeten),
+        E.txid < func.txid_snapshot_xmin(func.txid_current_snapshot()),
+    )
+    if after:
+        stmt = stmt.where(tuple_(E.txid, E.id) > tuple_(*cursor_lesen(after)))
+    return db.scalar(stmt.limit(1)) is not None
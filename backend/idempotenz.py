@@ -0,0 +1,112 @@
+# backend/idempotenz.py
+"""
+Idempotency-Key für POST-Endpunkte.
+
+Der Schlüssel wird in derselben Transaktion wie der eigentliche Schreibvorgang angelegt
+(INSERT ... ON CONFLICT). Dadurch gilt:
+- normaler Weg: ein zusätzliches INSERT, die Antwort wird vor dem Commit mitgeschrieben;
+- Wiederholung: die gespeicherte Antwort wird ohne erneuten Schreibvorgang zurückgegeben;
+- parallele Duplikate: Postgres lässt das zweite INSERT auf den Ausgang des ersten warten,
+  danach sieht es die gespeicherte Antwort (oder übernimmt den Schlüssel nach einem Rollback);
+- abgelaufene Schlüssel (älter als IDEMPOTENZ_TTL) werden beim nächsten Zugriff überschrieben
+  und vom Planer (backend/vorberechnung.py) regelmäßig in Batches gelöscht.
+
+Zeitstempel kommen aus der DB (`now()` in UTC, Spalte ohne Zeitzone), nicht von der App-Uhr.
+"""
+from __future__ import annotations
+
+import hashlib
+from datetime import timedelta
+from typing import Any, Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models as m
+from .database import get_db
+
+IDEMPOTENZ_HEADER = "Idempotency-Key"
+IDEMPOTENZ_TTL = timedelta(hours=24)
+AUFRAEUMEN_BATCH = 10000
+
+
+def _jetzt_utc():
+    return func.timezone("UTC", func.now())
+
+
+class Idempotenz:
+    """Pro Request: `replay` ist gesetzt, wenn der Schlüssel schon eine Antwort hat."""
+
+    def __init__(self, db: Session, schluessel: Optional[str]):
+        self.db = db
+        self.schluessel = schluessel
+        self.replay: Optional[JSONResponse] = None
+
+    def speichern(self, obj: Any, schema: Any, status_code: int = 200) -> None:
+        """Antwort zum Schlüssel ablegen (vor dem Commit aufrufen, gleiche Transaktion)."""
+        if not self.schluessel:
+            return
+        self.db.flush()  # IDs/Defaults vergeben
+        row = self.db.get(m.IdempotenzSchluessel, self.schluessel)
+        row.status_code = status_code
+        row.antwort = jsonable_encoder(schema.model_validate(obj))
+
+
+async def _body_fingerprint(request: Request) -> str:
+    return hashlib.sha256(await request.body()).hexdigest()
+
+
+def idempotenz(
+    request: Request,
+    fingerprint: str = Depends(_body_fingerprint),
+    db: Session = Depends(get_db),
+) -> Idempotenz:
+    schluessel = request.headers.get(IDEMPOTENZ_HEADER)
+    idem = Idempotenz(db, schluessel)
+    if not schluessel:
+        return idem
+    if len(schluessel) > 200:
+        raise HTTPException(400, f"{IDEMPOTENZ_HEADER} zu lang (max. 200 Zeichen)")
+
+    jetzt = _jetzt_utc()
+    pfad = request.url.path
+    K = m.IdempotenzSchluessel
+    stmt = (
+        pg_insert(K)
+        .values(schluessel=schluessel, pfad=pfad, fingerprint=fingerprint, erstellt_am=jetzt)
+        .on_conflict_do_update(
+            index_elements=[K.schluessel],
+            set_={"pfad": pfad, "fingerprint": fingerprint, "erstellt_am": jetzt,
+                  "status_code": None, "antwort": None},
+            where=K.erstellt_am < jetzt - IDEMPOTENZ_TTL,
+        )
+        .returning(K.schluessel)
+    )
+    if db.scalar(stmt) is not None:
+        return idem  # Schlüssel neu (oder abgelaufen) -> Schreibvorgang ausführen
+
+    row = db.get(K, schluessel)
+    if row.pfad != pfad or row.fingerprint != fingerprint:
+        raise HTTPException(422, f"{IDEMPOTENZ_HEADER} wurde bereits für eine andere Anfrage verwendet")
+    if row.antwort is None:
+        raise HTTPException(409, "Anfrage mit diesem Idempotency-Key ist noch in Bearbeitung")
+    idem.replay = JSONResponse(row.antwort, status_code=row.status_code, headers={"Idempotent-Replayed": "true"})
+    return idem
+
+
+def idempotenz_aufraeumen(db: Session, batch: int = AUFRAEUMEN_BATCH) -> int:
+    """Abgelaufene Schlüssel entfernen, höchstens `batch` je Aufruf (kurze Transaktion)."""
+    K = m.IdempotenzSchluessel
+    abgelaufen = (
+        select(K.schluessel)
+        .where(K.erstellt_am < _jetzt_utc() - IDEMPOTENZ_TTL)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+    )
+    res = db.execute(delete(K).where(K.schluessel.in_(abgelaufen)))
+    db.commit()
+    return res.rowcount
@@ -0,0 +1,237 @@
+# backend/live.py
+"""
+Server-Push (Server-Sent Events) für Status-/Standortänderungen von Geräten und Vermietungen.
+
+Ein Verteiler pro Prozess liest das Änderungsprotokoll (`ereignisse`) und verteilt neue Einträge
+an alle verbundenen Clients, statt dass jeder Browser-Tab `/geraete` pollt:
+- Wecken per Postgres LISTEN/NOTIFY (Trigger auf `ereignisse`, feuert beim Commit),
+  zusätzlich ein Sicherheits-Poll alle VERTEILER_POLL_SEKUNDEN; ist die DB nicht erreichbar,
+  wird das LISTEN im Threadpool mit exponentiellem Backoff neu versucht (bis
+  LISTEN_BACKOFF_MAX_SEKUNDEN), der Event-Loop wartet nie auf den Verbindungsaufbau;
+- pro Abonnent eine begrenzte Queue; läuft sie voll (langsamer Client), bekommt er ein
+  `reset`-Ereignis und wird getrennt, statt den Verteiler aufzuhalten;
+- Wiederaufnahme über `Last-Event-ID` bzw. `?after=`: die letzten PUFFER_GROESSE Ereignisse
+  liegen im Speicher; ist der Cursor älter, kommt ebenfalls `reset` (Client lädt einmal neu).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from .database import SessionLocal, engine
+from .ereignisse import cursor_lesen, cursor_text, ereignisse_kopf, ereignisse_seit
+
+log = logging.getLogger(__name__)
+
+LIVE_ENTITAETEN = ("geraete", "vermietungen")
+NOTIFY_KANAL = "ereignisse"
+VERTEILER_POLL_SEKUNDEN = 5.0
+KEEPALIVE_SEKUNDEN = 15.0
+QUEUE_GROESSE = 256
+PUFFER_GROESSE = 2000
+LISTEN_TIMEOUT_SEKUNDEN = 5
+LISTEN_BACKOFF_MAX_SEKUNDEN = 300.0
+
+_RESET = object()
+
+
+class Abonnent:
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_GROESSE)
+        self.getrennt = False
+
+
+class Verteiler:
+    def __init__(self) -> None:
+        self.abonnenten: set[Abonnent] = set()
+        self.puffer: deque[tuple[tuple[int, int], dict]] = deque(maxlen=PUFFER_GROESSE)
+        self.cursor: Optional[str] = None
+        self.anfang: tuple[int, int] = (0, 0)  # ab hier (exklusiv) ist der Puffer lückenlos
+        self._wecker = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._listen_conn = None
+        self._listen_fehler = 0  # Fehlversuche seit der letzten funktionierenden Verbindung
+        self._listen_naechster = 0.0  # loop.time(), ab dem neu versucht wird
+
+    # ---------- Lebenszyklus ----------
+    async def start(self) -> None:
+        self.cursor = await run_in_threadpool(self._kopf_lesen)
+        self.anfang = cursor_lesen(self.cursor) if self.cursor else (0, 0)
+        await self._listen_starten()
+        self._task = asyncio.create_task(self._schleife())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        self._listen_beenden()
+        for abo in list(self.abonnenten):
+            self._trennen(abo)
+
+    async def _listen_starten(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._listen_naechster:
+            return
+        try:
+            conn = await run_in_threadpool(self._listen_verbinden)
+        except Exception:
+            self._listen_fehler += 1
+            pause = min(VERTEILER_POLL_SEKUNDEN * 2 ** (self._listen_fehler - 1), LISTEN_BACKOFF_MAX_SEKUNDEN)
+            self._listen_naechster = loop.time() + pause
+            if self._listen_fehler == 1:
+                log.warning("LISTEN %s nicht möglich, nur Poll-Betrieb", NOTIFY_KANAL, exc_info=True)
+            else:
+                log.warning("LISTEN %s weiterhin nicht möglich (%d. Versuch), nächster in %.0f s",
+                            NOTIFY_KANAL, self._listen_fehler, pause)
+            return
+        loop.add_reader(conn.fileno(), self._notify_lesen)
+        self._listen_conn = conn
+        self._listen_fehler, self._listen_naechster = 0, 0.0
+
+    @staticmethod
+    def _listen_verbinden():
+        """Eigene DBAPI-Verbindung (nicht aus dem Pool) für LISTEN; blockiert, daher im Threadpool."""
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        cparams.setdefault("connect_timeout", LISTEN_TIMEOUT_SEKUNDEN)
+        conn = engine.dialect.dbapi.connect(*cargs, **cparams)
+        try:
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {NOTIFY_KANAL}")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _listen_beenden(self) -> None:
+        conn, self._listen_conn = self._listen_conn, None
+        if conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+            conn.close()
+        except Exception:
+            pass
+
+    def _notify_lesen(self) -> None:
+        try:
+            self._listen_conn.poll()
+            self._listen_conn.notifies.clear()
+        except Exception:
+            log.warning("LISTEN-Verbindung verloren", exc_info=True)
+            self._listen_beenden()
+        self._wecker.set()
+
+    # ---------- Verteilen ----------
+    async def _schleife(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wecker.wait(), timeout=VERTEILER_POLL_SEKUNDEN)
+            except asyncio.TimeoutError:
+                pass
+            self._wecker.clear()
+            if self._listen_conn is None:
+                await self._listen_starten()
+            try:
+                neu, self.cursor = await run_in_threadpool(self._neue_lesen, self.cursor)
+            except Exception:
+                log.exception("Ereignisse konnten nicht gelesen werden")
+                continue
+            for pos, item in neu:
+                if len(self.puffer) == self.puffer.maxlen:
+                    self.anfang = self.puffer[0][0]
+                self.puffer.append((pos, item))
+                for abo in list(self.abonnenten):
+                    self._senden(abo, item)
+
+    @staticmethod
+    def _kopf_lesen() -> Optional[str]:
+        with SessionLocal() as db:
+            return ereignisse_kopf(db)
+
+    @staticmethod
+    def _neue_lesen(cursor: Optional[str]):
+        neu = []
+        with SessionLocal() as db:
+            while True:
+                seite = ereignisse_seit(db, cursor, limit=1000)
+                cursor = seite["cursor"]
+                for e in seite["items"]:
+                    if e.entitaet not in LIVE_ENTITAETEN:
+                        continue
+                    item = jsonable_encoder({
+                        "id": cursor_text(e.txid, e.id),
+                        "entitaet": e.entitaet,
+                        "entitaet_id": e.entitaet_id,
+                        "aktion": e.aktion,
+                        "daten": e.daten,
+                        "zeitpunkt": e.zeitpunkt,
+                    })
+                    neu.append(((e.txid, e.id), item))
+                if len(seite["items"]) < 1000:
+                    return neu, cursor
+
+    def _senden(self, abo: Abonnent, item) -> None:
+        if abo.getrennt:
+            return
+        try:
+            abo.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._trennen(abo)
+
+    def _trennen(self, abo: Abonnent) -> None:
+        self.abonnenten.discard(abo)
+        abo.getrennt = True
+        while not abo.queue.empty():
+            abo.queue.get_nowait()
+        abo.queue.put_nowait(_RESET)
+
+    # ---------- Abonnieren ----------
+    def anmelden(self, after: Optional[str]) -> Abonnent:
+        """Neuer Abonnent; mit `after` werden gepufferte Ereignisse danach zuerst zugestellt."""
+        abo = Abonnent()
+        if after:
+            try:
+                pos = cursor_lesen(after)
+            except ValueError:
+                pos = None
+            if pos is None or pos < self.anfang:
+                self._trennen(abo)
+                return abo
+            for p, item in self.puffer:
+                if p > pos:
+                    self._senden(abo, item)
+            if abo.getrennt:  # Nachholen passte nicht in die Queue
+                return abo
+        self.abonnenten.add(abo)
+        return abo
+
+    def abmelden(self, abo: Abonnent) -> None:
+        self.abonnenten.discard(abo)
+
+
+verteiler = Verteiler()
+
+
+async def sse_strom(abo: Abonnent, ist_getrennt) -> AsyncIterator[str]:
+    """SSE-Frames für einen Abonnenten; endet bei Verbindungsabbruch oder `reset`."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(abo.queue.get(), timeout=KEEPALIVE_SEKUNDEN)
+            except asyncio.TimeoutError:
+                if await ist_getrennt():
+                    return
+                yield ": ping\n\n"
+                continue
+            if item is _RESET:
+                yield "event: reset\ndata: {}\n\n"
+                return
+            yield f"id: {item['id']}\nevent: {item['entitaet']}\ndata: {json.dumps(item)}\n\n"
+    finally:
+        verteiler.abmelden(abo)
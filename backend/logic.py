@@ -1,52 +1,125 @@
 from __future__ import annotations
 from datetime import date
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import Date, select, func, and_, or_, case, literal, tuple_, union_all
 from . import models as m
 from .utils.date_math import overlap_days, days_inclusive
 from .schemas import SatzEinheit, VermietStatus
-from datetime import date as _today
+from datetime import date as _date
 
 # ---------- CRUD helpers (illustrative subset; FastAPI endpoints use these) ----------
-def list_geraete(db: Session, status=None, standort_typ=None, skip=0, limit=50):
-    stmt = select(m.Geraet)
+def _geraete_filter(stmt, status=None, standort_typ=None, kategorie=None, mietpark_id=None, firma_id=None):
     if status:
         stmt = stmt.where(m.Geraet.status == status)
     if standort_typ:
         stmt = stmt.where(m.Geraet.standort_typ == standort_typ)
+    if kategorie:
+        stmt = stmt.where(m.Geraet.kategorie == kategorie)
+    if mietpark_id:
+        stmt = stmt.where(m.Geraet.mietpark_id == mietpark_id)
+    if firma_id:
+        stmt = stmt.where(m.Geraet.firma_id == firma_id)
+    return stmt
+
+def list_geraete(db: Session, status=None, standort_typ=None, skip=0, limit=50, firma_id=None):
+    stmt = _geraete_filter(select(m.Geraet), status=status, standort_typ=standort_typ, firma_id=firma_id)
     stmt = stmt.order_by(m.Geraet.id).offset(skip).limit(limit)
     return db.scalars(stmt).all()
 
-def count_geraete(db: Session, status=None, standort_typ=None):
-    stmt = select(func.count(m.Geraet.id))
-    if status:
-        stmt = stmt.where(m.Geraet.status == status)
-    if standort_typ:
-        stmt = stmt.where(m.Geraet.standort_typ == standort_typ)
+def count_geraete(db: Session, status=None, standort_typ=None, firma_id=None):
+    stmt = _geraete_filter(select(func.count(m.Geraet.id)), status=status, standort_typ=standort_typ, firma_id=firma_id)
     return db.scalar(stmt)
 
+# Facetten der Geräteübersicht: GROUPING()-Bitmaske (Bit = 1 -> Spalte nicht gruppiert)
+_FACETTEN_SPALTEN = ("status", "standort_typ", "kategorie", "mietpark_id", "firma_id")
+
+def facetten_geraete(db: Session, status=None, standort_typ=None, kategorie=None, mietpark_id=None, firma_id=None):
+    """
+    Alle Zähler der Geräteübersicht in einer Abfrage (GROUPING SETS): Gesamtzahl, je Einzelfacette
+    und je Kombination Status x Standort (ersetzt die einzelnen /geraete/count-Aufrufe).
+    """
+    G = m.Geraet
+    spalten = [getattr(G, name) for name in _FACETTEN_SPALTEN]
+    alle = (1 << len(spalten)) - 1
+    bit = {name: 1 << (len(spalten) - 1 - i) for i, name in enumerate(_FACETTEN_SPALTEN)}
+
+    stmt = select(*spalten, func.grouping(*spalten).label("g"), func.count().label("anzahl"))
+    stmt = _geraete_filter(
+        stmt, status=status, standort_typ=standort_typ, kategorie=kategorie,
+        mietpark_id=mietpark_id, firma_id=firma_id,
+    )
+    stmt = stmt.group_by(func.grouping_sets(tuple_(), *spalten, tuple_(G.status, G.standort_typ)))
+
+    res = {"gesamt": 0, "status_standort": [], **{name: [] for name in _FACETTEN_SPALTEN}}
+    einzel = {alle ^ bit[name]: name for name in _FACETTEN_SPALTEN}
+    status_standort = alle ^ bit["status"] ^ bit["standort_typ"]
+    for row in db.execute(stmt):
+        if row.g == alle:
+            res["gesamt"] = row.anzahl
+        elif row.g == status_standort:
+            res["status_standort"].append(
+                {"status": row.status, "standort_typ": row.standort_typ, "anzahl": row.anzahl}
+            )
+        else:
+            name = einzel[row.g]
+            res[name].append({"wert": getattr(row, name), "anzahl": row.anzahl})
+    return res
+
+# ---------- Quellen (heiß oder heiß + Archiv) ----------
+def _quelle(tabelle, archiv, mit_archiv: bool):
+    """Tabelle selbst oder UNION ALL mit ihrer Archivtabelle (gleiche Spaltennamen)."""
+    if not mit_archiv:
+        return tabelle
+    spalten = [c.name for c in tabelle.columns]
+    return union_all(
+        select(tabelle),
+        select(*[archiv.c[n] for n in spalten]),
+    ).subquery(f"{tabelle.name}_alle")
+
+def _vermietungen_quelle(mit_archiv: bool = False):
+    return _quelle(m.Vermietung.__table__, m.vermietungen_archiv, mit_archiv)
+
+def _positionen_quelle(mit_archiv: bool = False):
+    return _quelle(m.VermietungPosition.__table__, m.vermietung_positionen_archiv, mit_archiv)
+
+def _geraete_quelle(mit_archiv: bool = False):
+    return _quelle(m.Geraet.__table__, m.geraete_archiv, mit_archiv)
+
+def _nur_firma(stmt, V, firma_id, mit_archiv: bool = False):
+    """Vermietungs-Abfrage auf die Geräte einer Firma einschränken (nutzt ix_geraete_firma_status_id)."""
+    if firma_id:
+        G = _geraete_quelle(mit_archiv)
+        stmt = stmt.join(G, G.c.id == V.c.geraet_id).where(G.c.firma_id == firma_id)
+    return stmt
+
 # ---------- Reports ----------
 def calc_miete_for_zeitraum(satz_wert: float, einheit: SatzEinheit, tage: int) -> float:
     if tage <= 0:
         return 0.0
     if einheit == SatzEinheit.TAEGLICH:
         return satz_wert * tage
+    if einheit == SatzEinheit.WOECHENTLICH:
+        return satz_wert * (tage / 7.0)
     if einheit == SatzEinheit.MONATLICH:
         # Civil months are variable; for reporting, use 30-day commercial month for fairness
         return satz_wert * (tage / 30.0)
     return 0.0
 
-def report_auslastung(db: Session, von: date, bis: date, geraet_id: int | None):
+def report_auslastung(
+    db: Session, von: date, bis: date, geraet_id: int | None, firma_id: int | None = None, mit_archiv: bool = False
+):
     assert bis >= von
     tage_gesamt = days_inclusive(von, bis)
 
-    v_stmt = select(m.Vermietung)
+    V = _vermietungen_quelle(mit_archiv)
+    v_stmt = select(V.c.geraet_id, V.c.von, V.c.bis)
     if geraet_id:
-        v_stmt = v_stmt.where(m.Vermietung.geraet_id == geraet_id)
+        v_stmt = v_stmt.where(V.c.geraet_id == geraet_id)
     v_stmt = v_stmt.where(
-        or_(m.Vermietung.status.in_([VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN, VermietStatus.RESERVIERT]))
+        or_(V.c.status.in_([VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN, VermietStatus.RESERVIERT]))
     )
-    vermietungen = db.scalars(v_stmt).all()
+    v_stmt = _nur_firma(v_stmt, V, firma_id, mit_archiv)
+    vermietungen = db.execute(v_stmt).all()
 
     by_geraet: dict[int, int] = {}
     for v in vermietungen:
@@ -59,9 +132,12 @@ def report_auslastung(db: Session, von: date, bis: date, geraet_id: int | None):
     items = []
     sum_vermietet = 0
     # Include devices with zero rental in range
-    dev_stmt = select(m.Geraet.id)
+    G = _geraete_quelle(mit_archiv)
+    dev_stmt = select(G.c.id)
     if geraet_id:
-        dev_stmt = dev_stmt.where(m.Geraet.id == geraet_id)
+        dev_stmt = dev_stmt.where(G.c.id == geraet_id)
+    if firma_id:
+        dev_stmt = dev_stmt.where(G.c.firma_id == firma_id)
     dev_ids = [row for row in db.scalars(dev_stmt).all()]
 
     for gid in dev_ids:
@@ -81,8 +157,10 @@ def report_auslastung(db: Session, von: date, bis: date, geraet_id: int | None):
 
     return {"items": items, "flotte_auslastung_prozent": flotte_auslastung}
 
-def report_abrechnung(db: Session, vermietung_id: int):
-    v = db.get(m.Vermietung, vermietung_id)
+def report_abrechnung(db: Session, vermietung_id: int, firma_id: int | None = None, mit_archiv: bool = False):
+    V = _vermietungen_quelle(mit_archiv)
+    v_stmt = _nur_firma(select(V).where(V.c.id == vermietung_id), V, firma_id, mit_archiv)
+    v = db.execute(v_stmt).first()
     if not v:
         raise ValueError("Vermietung nicht gefunden")
     if v.status not in [VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN, VermietStatus.STORNIERT, VermietStatus.RESERVIERT]:
@@ -92,8 +170,9 @@ def report_abrechnung(db: Session, vermietung_id: int):
     tage = days_inclusive(v.von, bis_eff)
     miete = calc_miete_for_zeitraum(v.satz_wert, v.satz_einheit, tage)
 
-    pos_stmt = select(m.VermietungPosition).where(m.VermietungPosition.vermietung_id == v.id)
-    positionen = db.scalars(pos_stmt).all()
+    P = _positionen_quelle(mit_archiv)
+    pos_stmt = select(P.c.menge, P.c.vk_einzelpreis, P.c.kosten_intern).where(P.c.vermietung_id == v.id)
+    positionen = db.execute(pos_stmt).all()
     pos_sum = sum(p.menge * p.vk_einzelpreis for p in positionen)
     kosten_sum = sum(p.kosten_intern for p in positionen)
 
@@ -110,33 +189,48 @@ def report_abrechnung(db: Session, vermietung_id: int):
         "marge": round(marge, 2),
     }
 
-def report_geraet_finanzen(db: Session, geraet_id: int, von: date | None = None, bis: date | None = None):
-    g = db.get(m.Geraet, geraet_id)
-    if not g:
+def report_geraet_finanzen(
+    db: Session,
+    geraet_id: int,
+    von: date | None = None,
+    bis: date | None = None,
+    firma_id: int | None = None,
+    mit_archiv: bool = False,
+):
+    G = _geraete_quelle(mit_archiv)
+    g = db.execute(select(G.c.id, G.c.firma_id).where(G.c.id == geraet_id)).first()
+    if not g or (firma_id and g.firma_id != firma_id):
         raise ValueError("Gerät nicht gefunden")
 
-    v_stmt = select(m.Vermietung).where(m.Vermietung.geraet_id == geraet_id)
+    V = _vermietungen_quelle(mit_archiv)
+    v_stmt = select(V.c.id, V.c.von, V.c.bis, V.c.satz_wert, V.c.satz_einheit).where(V.c.geraet_id == geraet_id)
     if von and bis:
-        v_stmt = v_stmt.where(or_(
-            and_(m.Vermietung.von <= bis, m.Vermietung.bis >= von)
-        ))
-    vermietungen = db.scalars(v_stmt).all()
+        v_stmt = v_stmt.where(and_(V.c.von <= bis, or_(V.c.bis.is_(None), V.c.bis >= von)))
+    vermietungen = db.execute(v_stmt).all()
+
+    # Positionen aller Vermietungen in einer Abfrage summieren
+    P = _positionen_quelle(mit_archiv)
+    pos_stmt = (
+        select(
+            func.coalesce(func.sum(P.c.menge * P.c.vk_einzelpreis), 0.0),
+            func.coalesce(func.sum(P.c.kosten_intern), 0.0),
+        )
+        .where(P.c.vermietung_id.in_([v.id for v in vermietungen]))
+    )
+    pos_einnahmen, pos_kosten = db.execute(pos_stmt).one() if vermietungen else (0.0, 0.0)
 
-    einnahmen = 0.0
-    kosten = 0.0
+    einnahmen = float(pos_einnahmen)
+    kosten = float(pos_kosten)
     tage_vermietet = 0
     # Evaluate each rental
     for v in vermietungen:
+        v_bis = v.bis or _date.today()
         w_start = von or v.von
-        w_end = bis or v.bis
-        overlap = overlap_days(v.von, v.bis, w_start, w_end)
+        w_end = bis or v_bis
+        overlap = overlap_days(v.von, v_bis, w_start, w_end)
         tage_vermietet += overlap
 
         einnahmen += calc_miete_for_zeitraum(v.satz_wert, v.satz_einheit, overlap)
-        # positions
-        for p in v.positionen:
-            einnahmen += p.menge * p.vk_einzelpreis
-            kosten += p.kosten_intern
 
     tage_gesamt = days_inclusive(von, bis) if (von and bis) else max(tage_vermietet, 1)  # avoid /0
     auslastung = (tage_vermietet / tage_gesamt * 100.0) if tage_gesamt else 0.0
@@ -151,3 +245,294 @@ def report_geraet_finanzen(db: Session, geraet_id: int, von: date | None = None,
         "tage_vermietet": tage_vermietet,
         "auslastung_prozent": round(auslastung, 2),
     }
+
+KUNDEN_SORTIERUNG = ("einnahmen", "marge", "miete", "positionen", "kosten", "geraetetage", "vermietungen")
+
+def report_kunden(
+    db: Session,
+    von: date,
+    bis: date,
+    sortierung: str = "einnahmen",
+    skip: int = 0,
+    limit: int = 50,
+    firma_id: int | None = None,
+    mit_archiv: bool = False,
+):
+    """
+    Umsatz, Kosten, Marge und vermietete Gerätetage je Kunde im Zeitraum (absteigend nach `sortierung`).
+    Eine gruppierte Abfrage: Miete je Vermietung anteilig nach Überlappungstagen (wie
+    report_geraet_finanzen, offene Vermietungen bis heute), Positionen voll für jede Vermietung
+    im Zeitraum; Gesamtzahl der Kunden per Fensterfunktion.
+    """
+    assert bis >= von
+    if sortierung not in KUNDEN_SORTIERUNG:
+        raise ValueError(f"Unbekannte Sortierung: {sortierung}")
+
+    V = _vermietungen_quelle(mit_archiv)
+    v_bis = func.coalesce(V.c.bis, func.current_date())
+    # wie overlap_days: nie negativ (offene Vermietung, die erst nach heute beginnt)
+    tage = func.greatest(func.least(v_bis, bis) - func.greatest(V.c.von, von) + 1, 0)
+    miete = case(
+        (V.c.satz_einheit == SatzEinheit.TAEGLICH, V.c.satz_wert * tage),
+        (V.c.satz_einheit == SatzEinheit.WOECHENTLICH, V.c.satz_wert * tage / 7.0),
+        (V.c.satz_einheit == SatzEinheit.MONATLICH, V.c.satz_wert * tage / 30.0),
+        else_=0.0,
+    )
+    vm_stmt = (
+        select(V.c.id, V.c.kunde_id, tage.label("tage"), miete.label("miete"))
+        .where(
+            V.c.status.in_([VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN]),
+            V.c.von <= bis,
+            v_bis >= von,
+        )
+    )
+    vm = _nur_firma(vm_stmt, V, firma_id, mit_archiv).cte("vm")
+
+    P = _positionen_quelle(mit_archiv)
+    pos = (
+        select(
+            P.c.vermietung_id,
+            func.sum(P.c.menge * P.c.vk_einzelpreis).label("umsatz"),
+            func.sum(P.c.kosten_intern).label("kosten"),
+        )
+        .join(vm, vm.c.id == P.c.vermietung_id)
+        .group_by(P.c.vermietung_id)
+        .cte("pos")
+    )
+
+    K = m.Kunde
+    miete_sum = func.coalesce(func.sum(vm.c.miete), 0.0)
+    pos_sum = func.coalesce(func.sum(pos.c.umsatz), 0.0)
+    kosten_sum = func.coalesce(func.sum(pos.c.kosten), 0.0)
+    spalten = {
+        "miete": miete_sum.label("miete"),
+        "positionen": pos_sum.label("positionen"),
+        "kosten": kosten_sum.label("kosten"),
+        "einnahmen": (miete_sum + pos_sum).label("einnahmen"),
+        "marge": (miete_sum + pos_sum - kosten_sum).label("marge"),
+        "geraetetage": func.sum(vm.c.tage).label("geraetetage"),
+        "vermietungen": func.count(vm.c.id).label("vermietungen"),
+    }
+    stmt = (
+        select(vm.c.kunde_id, K.name, *spalten.values(), func.count().over().label("gesamt"))
+        .join(K, K.id == vm.c.kunde_id)
+        .outerjoin(pos, pos.c.vermietung_id == vm.c.id)
+        .group_by(vm.c.kunde_id, K.name)
+        .order_by(spalten[sortierung].desc(), vm.c.kunde_id)
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = db.execute(stmt).all()
+
+    items = [
+        {
+            "kunde_id": r.kunde_id,
+            "name": r.name,
+            "anzahl_vermietungen": r.vermietungen,
+            "geraetetage": r.geraetetage,
+            "miete_summe": round(r.miete, 2),
+            "positionen_summe": round(r.positionen, 2),
+            "einnahmen": round(r.einnahmen, 2),
+            "kosten_summe": round(r.kosten, 2),
+            "marge": round(r.marge, 2),
+        }
+        for r in rows
+    ]
+    # Seite hinter dem Ende: keine Zeile, also auch keine Gesamtzahl -> separat zählen
+    if rows:
+        gesamt = rows[0].gesamt
+    else:
+        gesamt = db.scalar(select(func.count(func.distinct(vm.c.kunde_id)))) if skip else 0
+    return {"gesamt": gesamt, "items": items}
+
+# ---------- Gerätedetail ----------
+def geraet_detail(
+    db: Session,
+    geraet_id: int,
+    anzahl_vermietungen: int = 20,
+    anzahl_wartungen: int = 50,
+    firma_id: int | None = None,
+):
+    """
+    Alles für die Geräteseite in fester Abfragezahl (unabhängig von der Historie):
+    Gerät, letzte Vermietungen (+ Positionen per selectinload, ein IN-Query), letzte Wartungen,
+    letzter Zählerstand und Finanzkennzahlen (report_geraet_finanzen über die ganze Laufzeit).
+    """
+    g = db.get(m.Geraet, geraet_id)
+    if not g or (firma_id and g.firma_id != firma_id):
+        raise ValueError("Gerät nicht gefunden")
+
+    V, W, Z = m.Vermietung, m.Wartung, m.Zaehlerstand
+    vermietungen = db.scalars(
+        select(V)
+        .where(V.geraet_id == geraet_id)
+        .options(selectinload(V.positionen))
+        .order_by(V.von.desc(), V.id.desc())
+        .limit(anzahl_vermietungen)
+    ).all()
+    wartungen = db.scalars(
+        select(W).where(W.geraet_id == geraet_id).order_by(W.datum.desc(), W.id.desc()).limit(anzahl_wartungen)
+    ).all()
+    zaehlerstand = db.scalars(
+        select(Z).where(Z.geraet_id == geraet_id).order_by(Z.zeitpunkt.desc()).limit(1)
+    ).first()
+
+    return {
+        "geraet": g,
+        "vermietungen": vermietungen,
+        "wartungen": wartungen,
+        "letzter_zaehlerstand": zaehlerstand,
+        "finanzen": report_geraet_finanzen(db, geraet_id, firma_id=firma_id),
+    }
+
+# ---------- Stichtagsstand der Flotte ----------
+def flottenstand(db: Session, am: date, firma_id: int | None = None):
+    """
+    Status/Standort aller Geräte am Stichtag (Tagesende).
+    1) Historie: eine Bereichsabfrage `gueltig @> am` über den GiST-Index.
+    2) Für Geräte ohne Historie an diesem Tag (vor Beginn der Aufzeichnung): aus Vermietungen,
+       die den Stichtag abdecken -> VERMIETET/KUNDE; sonst unbekannt.
+    """
+    H = m.GeraetStatusHistorie
+    h_stmt = select(H.geraet_id, H.status, H.standort_typ, H.mietpark_id).where(H.gueltig.contains(am))
+    if firma_id:
+        h_stmt = h_stmt.where(H.firma_id == firma_id)
+    items = {
+        row.geraet_id: {
+            "geraet_id": row.geraet_id,
+            "status": row.status,
+            "standort_typ": row.standort_typ,
+            "mietpark_id": row.mietpark_id,
+            "quelle": "HISTORIE",
+        }
+        for row in db.execute(h_stmt)
+    }
+
+    # Geräte, die am Stichtag schon existierten, aber (noch) keine Historie haben
+    G, V = m.Geraet, m.Vermietung
+    ohne = (
+        select(G.id)
+        .where(or_(G.anschaffungsdatum.is_(None), G.anschaffungsdatum <= am))
+        .where(~select(H.id).where(H.geraet_id == G.id, func.lower(H.gueltig) <= am).exists())
+    )
+    ohne = _geraete_filter(ohne, firma_id=firma_id)
+    vermietet_stmt = (
+        select(V.geraet_id)
+        .where(
+            V.geraet_id.in_(ohne),
+            V.status.in_([VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN]),
+            V.von <= am,
+            or_(V.bis.is_(None), V.bis >= am),
+        )
+        .distinct()
+    )
+    vermietet = set(db.scalars(vermietet_stmt))
+    for gid in db.scalars(ohne):
+        if gid in items:
+            continue
+        items[gid] = {
+            "geraet_id": gid,
+            "status": m.GeraetStatus.VERMIETET if gid in vermietet else None,
+            "standort_typ": m.StandortTyp.KUNDE if gid in vermietet else None,
+            "mietpark_id": None,
+            "quelle": "VERMIETUNGEN" if gid in vermietet else None,
+        }
+    return [items[k] for k in sorted(items)]
+
+# ---------- Wartungsplan ----------
+def wartungen_faellig(
+    db: Session,
+    vorlauf_tage: int = 0,
+    vorlauf_stunden: float = 0.0,
+    stichtag: date | None = None,
+    firma_id: int | None = None,
+):
+    """
+    Fällige/überfällige Wartungen der ganzen Flotte in einer Abfrage.
+    Letzte Wartung, letzter Zählerstand und Zählerstand zum Zeitpunkt der letzten Wartung
+    werden per Window-Funktion je Gerät bestimmt; Intervalle kommen aus `wartungsintervalle`
+    (je Kategorie). Ohne bisherige Wartung zählen Stunden ab 0 und Tage ab Anschaffung.
+    """
+    stichtag = stichtag or date.today()
+    W, Z, G, I = m.Wartung, m.Zaehlerstand, m.Geraet, m.Wartungsintervall
+
+    lw = select(
+        W.geraet_id,
+        W.datum,
+        func.row_number().over(partition_by=W.geraet_id, order_by=(W.datum.desc(), W.id.desc())).label("rn"),
+    )
+    lz = select(
+        Z.geraet_id,
+        Z.stunden,
+        func.row_number().over(partition_by=Z.geraet_id, order_by=(Z.zeitpunkt.desc(), Z.id.desc())).label("rn"),
+    )
+    if firma_id:
+        # Window-Funktionen nur über die Geräte der Firma laufen lassen
+        firma_geraete = select(G.id).where(G.firma_id == firma_id)
+        lw = lw.where(W.geraet_id.in_(firma_geraete))
+        lz = lz.where(Z.geraet_id.in_(firma_geraete))
+    lw = lw.cte("lw")
+    lz = lz.subquery("lz")
+    # Zählerstand am Tag der letzten Wartung (letzte Ablesung bis einschließlich Wartungsdatum)
+    zw = (
+        select(
+            Z.geraet_id,
+            Z.stunden,
+            func.row_number().over(partition_by=Z.geraet_id, order_by=(Z.zeitpunkt.desc(), Z.id.desc())).label("rn"),
+        )
+        .join(lw, and_(lw.c.geraet_id == Z.geraet_id, lw.c.rn == 1, Z.zeitpunkt < lw.c.datum + 1))
+        .subquery("zw")
+    )
+
+    stunden_akt = func.coalesce(lz.c.stunden, G.stundenzähler, 0.0)
+    stunden_seit = stunden_akt - func.coalesce(zw.c.stunden, 0.0)
+    basis_datum = func.coalesce(lw.c.datum, G.anschaffungsdatum)
+    tage_seit = literal(stichtag, Date) - basis_datum
+
+    stmt = (
+        select(
+            G.id, G.name, G.kategorie, lw.c.datum,
+            stunden_akt.label("stunden_akt"),
+            stunden_seit.label("stunden_seit"),
+            tage_seit.label("tage_seit"),
+            I.intervall_stunden, I.intervall_tage,
+        )
+        .join(I, I.kategorie == G.kategorie)
+        .outerjoin(lw, and_(lw.c.geraet_id == G.id, lw.c.rn == 1))
+        .outerjoin(lz, and_(lz.c.geraet_id == G.id, lz.c.rn == 1))
+        .outerjoin(zw, and_(zw.c.geraet_id == G.id, zw.c.rn == 1))
+        .where(G.status != m.GeraetStatus.AUSGEMUSTERT)
+        .where(or_(
+            and_(I.intervall_stunden.is_not(None), stunden_seit >= I.intervall_stunden - vorlauf_stunden),
+            and_(I.intervall_tage.is_not(None), tage_seit >= I.intervall_tage - vorlauf_tage),
+        ))
+    )
+    stmt = _geraete_filter(stmt, firma_id=firma_id)
+
+    items = []
+    for row in db.execute(stmt):
+        rest_h = round(row.intervall_stunden - row.stunden_seit, 2) if row.intervall_stunden is not None else None
+        rest_t = row.intervall_tage - row.tage_seit if (row.intervall_tage is not None and row.tage_seit is not None) else None
+        items.append({
+            "geraet_id": row.id,
+            "name": row.name,
+            "kategorie": row.kategorie,
+            "letzte_wartung": row.datum,
+            "stunden_aktuell": round(row.stunden_akt, 2),
+            "stunden_seit_wartung": round(row.stunden_seit, 2),
+            "tage_seit_wartung": row.tage_seit,
+            "rest_stunden": rest_h,
+            "rest_tage": rest_t,
+            "ueberfaellig": (rest_h is not None and rest_h <= 0) or (rest_t is not None and rest_t <= 0),
+        })
+
+    # dringendste zuerst: überfällige vor fälligen, dann nach Resttagen/-stunden
+    def _dringlichkeit(it):
+        inf = float("inf")
+        rest_t = it["rest_tage"] if it["rest_tage"] is not None else inf
+        rest_h = it["rest_stunden"] if it["rest_stunden"] is not None else inf
+        return (not it["ueberfaellig"], rest_t, rest_h, it["geraet_id"])
+
+    items.sort(key=_dringlichkeit)
+    return items
+
@@ -1,24 +1,44 @@
 # backend/main.py
 from __future__ import annotations
 
-from datetime import date
+from datetime import date, timedelta
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, text
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from . import models as m
 from . import schemas as s
-from .database import engine, get_db
+from .database import SessionLocal, engine, get_db
+from .antworten import FormatMiddleware, KompressionMiddleware, VerhandeltesJSON
+from .archiv import ARCHIV_BATCH, archivieren, firma_loeschen
+from .ereignisse import ereignisse_seit, protokolliere
+from .idempotenz import Idempotenz, idempotenz, idempotenz_aufraeumen
+from .live import sse_strom, verteiler
+from .preise import angebot
+from .sync import SYNC_LIMIT, sync_seit
+from .vorberechnung import (
+    auslastung_snapshot,
+    kunden_snapshot,
+    planer,
+    snapshots_berechnen,
+    snapshots_uebersicht,
+)
 from .logic import (
     report_auslastung,
     report_abrechnung,
     report_geraet_finanzen,
+    report_kunden,
     list_geraete,
     count_geraete,
+    facetten_geraete,
+    flottenstand,
+    geraet_detail,
+    wartungen_faellig,
 )
 
 # -------------------------------------------------------------------
@@ -39,6 +59,9 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=False,
 )
+# MessagePack-Wunsch (Accept) merken; Antworten ab KOMPRESSION_MIN_BYTES gzip/brotli-komprimieren
+app.add_middleware(FormatMiddleware)
+app.add_middleware(KompressionMiddleware)
 
 # -------------------------------------------------------------------
 # Startup: Tabellen anlegen + neue Spalten sicherstellen
@@ -47,13 +70,21 @@ app.add_middleware(
 def startup_create_tables() -> None:
     m.Base.metadata.create_all(bind=engine)
     ensure_columns()
+    with SessionLocal() as db:
+        idempotenz_aufraeumen(db)
 
 
 def ensure_columns() -> None:
     """
     Schema-Anpassungen, idempotent:
     - neue optionale Spalten auf 'geraete'
+    - 'vermietungen.satz_einheit' kennt WOECHENTLICH
     - 'vermietungen.bis' nullable + Check-Constraint: bis IS NULL OR bis >= von
+    - Indizes für den Wartungsplan und für Abfragen je Firma
+    - 'ereignisse.zeitpunkt' in UTC, NOTIFY-Trigger auf 'ereignisse' für den Live-Verteiler
+    - Trigger + Erstbefüllung für 'geraete_status_historie'
+    - 'updated_at' (Spalte + Trigger, UTC) auf allen Entitäten, Archivtabellen nur die Spalte
+    - 'archiviert_am' in UTC
     """
     stmts = """
     -- ============= GERÄTE: optionale Felder sicherstellen ==================
@@ -62,6 +93,9 @@ def ensure_columns() -> None:
     ALTER TABLE geraete ADD COLUMN IF NOT EXISTS mietpreis_einheit VARCHAR(20);
     ALTER TABLE geraete ADD COLUMN IF NOT EXISTS vermietet_in VARCHAR(2);
 
+    -- ============= VERMIETUNGEN: Wochensatz im DB-Enum ======================
+    ALTER TYPE satzeinheit ADD VALUE IF NOT EXISTS 'WOECHENTLICH';
+
     -- ============= VERMIETUNGEN: offenes Enddatum erlauben =================
     DO $$
     BEGIN
@@ -90,6 +124,90 @@ def ensure_columns() -> None:
           CHECK (bis IS NULL OR bis >= von);
       END IF;
     END $$;
+
+    -- ============= WARTUNGSPLAN: letzte Wartung / letzter Zählerstand je Gerät ==
+    CREATE INDEX IF NOT EXISTS ix_wartungen_geraet_datum ON wartungen (geraet_id, datum);
+    CREATE INDEX IF NOT EXISTS ix_zaehlerstaende_geraet_zeitpunkt ON zaehlerstaende (geraet_id, zeitpunkt);
+
+    -- ============= MANDANTEN: Zugriffe je Firma / Vermietungen je Gerät ======
+    CREATE INDEX IF NOT EXISTS ix_geraete_firma_status_id ON geraete (firma_id, status, id);
+    CREATE INDEX IF NOT EXISTS ix_vermietungen_geraet_von ON vermietungen (geraet_id, von);
+
+    -- ============= EREIGNISSE: Zeitpunkt in UTC (DB-Uhr) =======================
+    ALTER TABLE ereignisse ALTER COLUMN zeitpunkt SET DEFAULT timezone('UTC', now());
+
+    -- ============= EREIGNISSE: Live-Verteiler beim Commit wecken ===============
+    CREATE OR REPLACE FUNCTION ereignisse_notify() RETURNS trigger AS $$
+    BEGIN
+      PERFORM pg_notify('ereignisse', '');
+      RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS trg_ereignisse_notify ON ereignisse;
+    CREATE TRIGGER trg_ereignisse_notify AFTER INSERT ON ereignisse
+      FOR EACH STATEMENT EXECUTE PROCEDURE ereignisse_notify();
+
+    -- ============= STATUS-HISTORIE: Gültigkeitszeiträume je Gerät ==============
+    -- Stand je Tag = Stand am Tagesende: mehrere Änderungen am selben Tag überschreiben sich
+    CREATE OR REPLACE FUNCTION geraete_historie_pflegen() RETURNS trigger AS $$
+    BEGIN
+      IF TG_OP = 'UPDATE'
+         AND (OLD.status, OLD.standort_typ, OLD.mietpark_id, OLD.firma_id)
+             IS NOT DISTINCT FROM (NEW.status, NEW.standort_typ, NEW.mietpark_id, NEW.firma_id) THEN
+        RETURN NULL;
+      END IF;
+      IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM geraete_status_historie
+          WHERE geraet_id = OLD.id AND upper_inf(gueltig) AND lower(gueltig) = current_date;
+        UPDATE geraete_status_historie SET gueltig = daterange(lower(gueltig), current_date)
+          WHERE geraet_id = OLD.id AND upper_inf(gueltig);
+      END IF;
+      IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO geraete_status_historie (geraet_id, firma_id, status, standort_typ, mietpark_id, gueltig)
+          VALUES (NEW.id, NEW.firma_id, NEW.status, NEW.standort_typ, NEW.mietpark_id, daterange(current_date, NULL));
+      END IF;
+      RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS trg_geraete_historie ON geraete;
+    CREATE TRIGGER trg_geraete_historie
+      AFTER INSERT OR DELETE OR UPDATE OF status, standort_typ, mietpark_id, firma_id ON geraete
+      FOR EACH ROW EXECUTE PROCEDURE geraete_historie_pflegen();
+
+    -- Bestand ohne Historie: ab heute mit aktuellem Stand (davor über Vermietungen rekonstruiert)
+    INSERT INTO geraete_status_historie (geraet_id, firma_id, status, standort_typ, mietpark_id, gueltig)
+      SELECT g.id, g.firma_id, g.status, g.standort_typ, g.mietpark_id, daterange(current_date, NULL)
+      FROM geraete g
+      WHERE NOT EXISTS (SELECT 1 FROM geraete_status_historie h WHERE h.geraet_id = g.id);
+
+    -- ============= UPDATED_AT: Spalte + Trigger je Entität (UTC, kein Index) =====
+    CREATE OR REPLACE FUNCTION updated_at_setzen() RETURNS trigger AS $$
+    BEGIN
+      NEW.updated_at := timezone('UTC', now());
+      RETURN NEW;
+    END $$ LANGUAGE plpgsql;
+    DO $$
+    DECLARE t text;
+    BEGIN
+      FOREACH t IN ARRAY ARRAY['firmen', 'mietparks', 'kunden', 'geraete', 'vermietungen',
+                               'vermietung_positionen', 'rechnungen', 'wartungen', 'zaehlerstaende',
+                               'wartungsintervalle'] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL '
+                       'DEFAULT timezone(''UTC'', now())', t);
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN updated_at SET DEFAULT timezone(''UTC'', now())', t);
+        EXECUTE format('DROP INDEX IF EXISTS %I', 'ix_' || t || '_updated_at');
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', 'trg_' || t || '_updated_at', t);
+        EXECUTE format('CREATE TRIGGER %I BEFORE UPDATE ON %I FOR EACH ROW EXECUTE PROCEDURE updated_at_setzen()',
+                       'trg_' || t || '_updated_at', t);
+      END LOOP;
+      -- Archivtabellen übernehmen updated_at beim Verschieben (kein Trigger, kein Index); archiviert_am in UTC
+      FOREACH t IN ARRAY ARRAY['geraete_archiv', 'vermietungen_archiv', 'vermietung_positionen_archiv',
+                               'rechnungen_archiv', 'wartungen_archiv', 'zaehlerstaende_archiv'] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL '
+                       'DEFAULT timezone(''UTC'', now())', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', 'trg_' || t || '_updated_at', t);
+        EXECUTE format('DROP INDEX IF EXISTS %I', 'ix_' || t || '_updated_at');
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN archiviert_am SET DEFAULT timezone(''UTC'', now())', t);
+      END LOOP;
+    END $$;
     """
     with engine.begin() as conn:
         conn.execute(text(stmts))
@@ -105,15 +223,23 @@ def health():
 # FIRMA
 # -------------------------------------------------------------------
 @app.post("/firmen", response_model=s.FirmaOut)
-def create_firma(payload: s.FirmaBase, db: Session = Depends(get_db)):
+def create_firma(
+    payload: s.FirmaBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Firma(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.FirmaOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/firmen", response_model=List[s.FirmaOut])
+@app.get("/firmen", response_model=List[s.FirmaOut], response_class=VerhandeltesJSON)
 def list_firmen(db: Session = Depends(get_db)):
     return db.query(m.Firma).order_by(m.Firma.name).all()
 
@@ -125,6 +251,7 @@ def update_firma(firma_id: int, payload: s.FirmaBase, db: Session = Depends(get_
         raise HTTPException(404, "Firma nicht gefunden")
     for k, v in payload.dict().items():
         setattr(obj, k, v)
+    protokolliere(db, obj, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(obj)
     return obj
@@ -135,7 +262,11 @@ def delete_firma(firma_id: int, db: Session = Depends(get_db)):
     obj = db.get(m.Firma, firma_id)
     if not obj:
         raise HTTPException(404, "Firma nicht gefunden")
-    db.delete(obj)
+    try:
+        firma_loeschen(db, firma_id)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(409, str(e))
     db.commit()
     return
 
@@ -144,15 +275,23 @@ def delete_firma(firma_id: int, db: Session = Depends(get_db)):
 # MIETPARK
 # -------------------------------------------------------------------
 @app.post("/mietparks", response_model=s.MietparkOut)
-def create_mietpark(payload: s.MietparkBase, db: Session = Depends(get_db)):
+def create_mietpark(
+    payload: s.MietparkBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Mietpark(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.MietparkOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/mietparks", response_model=List[s.MietparkOut])
+@app.get("/mietparks", response_model=List[s.MietparkOut], response_class=VerhandeltesJSON)
 def list_mietparks(db: Session = Depends(get_db)):
     return db.query(m.Mietpark).order_by(m.Mietpark.name).all()
 
@@ -164,6 +303,7 @@ def update_mietpark(mietpark_id: int, payload: s.MietparkBase, db: Session = Dep
         raise HTTPException(404, "Mietpark nicht gefunden")
     for k, v in payload.dict().items():
         setattr(obj, k, v)
+    protokolliere(db, obj, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(obj)
     return obj
@@ -174,6 +314,11 @@ def delete_mietpark(mietpark_id: int, db: Session = Depends(get_db)):
     obj = db.get(m.Mietpark, mietpark_id)
     if not obj:
         raise HTTPException(404, "Mietpark nicht gefunden")
+    # zugeordnete Geräte verlieren den Mietpark: explizit setzen und protokollieren
+    for g in obj.geraete:
+        g.mietpark_id = None
+        protokolliere(db, g, m.EreignisAktion.GEAENDERT)
+    protokolliere(db, obj, m.EreignisAktion.GELOESCHT)
     db.delete(obj)
     db.commit()
     return
@@ -183,15 +328,23 @@ def delete_mietpark(mietpark_id: int, db: Session = Depends(get_db)):
 # KUNDE
 # -------------------------------------------------------------------
 @app.post("/kunden", response_model=s.KundeOut)
-def create_kunde(payload: s.KundeBase, db: Session = Depends(get_db)):
+def create_kunde(
+    payload: s.KundeBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Kunde(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.KundeOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/kunden", response_model=List[s.KundeOut])
+@app.get("/kunden", response_model=List[s.KundeOut], response_class=VerhandeltesJSON)
 def list_kunden(db: Session = Depends(get_db)):
     return db.query(m.Kunde).order_by(m.Kunde.name).all()
 
@@ -203,6 +356,7 @@ def update_kunde(kunde_id: int, payload: s.KundeBase, db: Session = Depends(get_
         raise HTTPException(404, "Kunde nicht gefunden")
     for k, v in payload.dict().items():
         setattr(obj, k, v)
+    protokolliere(db, obj, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(obj)
     return obj
@@ -212,33 +366,68 @@ def update_kunde(kunde_id: int, payload: s.KundeBase, db: Session = Depends(get_
 # GERÄT
 # -------------------------------------------------------------------
 @app.post("/geraete", response_model=s.GeraetOut)
-def create_geraet(payload: s.GeraetBase, db: Session = Depends(get_db)):
+def create_geraet(
+    payload: s.GeraetBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Geraet(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.GeraetOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/geraete", response_model=List[s.GeraetOut])
+@app.get("/geraete", response_model=List[s.GeraetOut], response_class=VerhandeltesJSON)
 def list_geraete_endpoint(
     status: Optional[s.GeraetStatus] = Query(None),
     standort_typ: Optional[s.StandortTyp] = Query(None),
+    firma_id: Optional[int] = Query(None),
     skip: int = 0,
     limit: int = 50,
     db: Session = Depends(get_db),
 ):
-    return list_geraete(db, status=status, standort_typ=standort_typ, skip=skip, limit=limit)
+    return list_geraete(db, status=status, standort_typ=standort_typ, skip=skip, limit=limit, firma_id=firma_id)
 
 
 @app.get("/geraete/count")
 def count_geraete_endpoint(
     status: Optional[s.GeraetStatus] = Query(None),
     standort_typ: Optional[s.StandortTyp] = Query(None),
+    firma_id: Optional[int] = Query(None),
     db: Session = Depends(get_db),
 ):
     # Frontend erwartet { "count": <number> }
-    return {"count": count_geraete(db, status=status, standort_typ=standort_typ)}
+    return {"count": count_geraete(db, status=status, standort_typ=standort_typ, firma_id=firma_id)}
+
+
+@app.get("/geraete/facets", response_model=s.GeraeteFacetten, response_class=VerhandeltesJSON)
+def geraete_facets_endpoint(
+    status: Optional[s.GeraetStatus] = Query(None),
+    standort_typ: Optional[s.StandortTyp] = Query(None),
+    kategorie: Optional[str] = Query(None),
+    mietpark_id: Optional[int] = Query(None),
+    firma_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+):
+    # alle Zähler der Übersicht in einem Roundtrip
+    return facetten_geraete(
+        db, status=status, standort_typ=standort_typ, kategorie=kategorie,
+        mietpark_id=mietpark_id, firma_id=firma_id,
+    )
+
+
+@app.get("/geraete/stand", response_model=List[s.GeraetStandItem], response_class=VerhandeltesJSON)
+def geraete_stand_endpoint(
+    am: date = Query(..., description="Stichtag (Stand am Tagesende)"),
+    firma_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+):
+    return flottenstand(db, am, firma_id=firma_id)
 
 
 @app.put("/geraete/{geraet_id}", response_model=s.GeraetOut)
@@ -248,6 +437,7 @@ def update_geraet(geraet_id: int, payload: s.GeraetBase, db: Session = Depends(g
         raise HTTPException(404, "Gerät nicht gefunden")
     for k, v in payload.dict().items():
         setattr(obj, k, v)
+    protokolliere(db, obj, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(obj)
     return obj
@@ -259,6 +449,10 @@ def delete_geraet(geraet_id: int, db: Session = Depends(get_db)):
     if not g:
         raise HTTPException(404, "Gerät nicht gefunden")
     try:
+        # Wartungen gehen per ORM-Cascade mit; Sync-Clients brauchen auch für sie Tombstones
+        for w in g.wartungen:
+            protokolliere(db, w, m.EreignisAktion.GELOESCHT)
+        protokolliere(db, g, m.EreignisAktion.GELOESCHT)
         db.delete(g)
         db.commit()
     except IntegrityError:
@@ -280,43 +474,111 @@ def get_geraet(geraet_id: int, db: Session = Depends(get_db)):
     return obj
 
 
+# Geräteseite in einem Abruf
+@app.get("/geraete/{geraet_id}/detail", response_model=s.GeraetDetail, response_class=VerhandeltesJSON)
+def get_geraet_detail(
+    geraet_id: int,
+    vermietungen: int = Query(20, ge=0, le=500, description="Anzahl letzter Vermietungen"),
+    wartungen: int = Query(50, ge=0, le=1000, description="Anzahl letzter Wartungen"),
+    firma_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        return geraet_detail(db, geraet_id, vermietungen, wartungen, firma_id)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+
+
 # Vermietungen zu einem Gerät
-@app.get("/geraete/{geraet_id}/vermietungen", response_model=List[s.VermietungOut])
-def list_vermietungen_geraet(geraet_id: int, db: Session = Depends(get_db)):
-    return (
-        db.query(m.Vermietung)
-        .filter(m.Vermietung.geraet_id == geraet_id)
-        .order_by(m.Vermietung.von.desc())
-        .all()
-    )
+@app.get(
+    "/geraete/{geraet_id}/vermietungen",
+    response_model=List[s.VermietungOut],
+    response_class=VerhandeltesJSON,
+)
+def list_vermietungen_geraet(
+    geraet_id: int, firma_id: Optional[int] = Query(None), db: Session = Depends(get_db)
+):
+    q = db.query(m.Vermietung).filter(m.Vermietung.geraet_id == geraet_id)
+    if firma_id:
+        g = db.get(m.Geraet, geraet_id)
+        if not g or g.firma_id != firma_id:
+            raise HTTPException(404, "Gerät nicht gefunden")
+        q = q.join(m.Geraet, m.Geraet.id == m.Vermietung.geraet_id).filter(m.Geraet.firma_id == firma_id)
+    return q.order_by(m.Vermietung.von.desc()).all()
 
 
 # -------------------------------------------------------------------
 # VERMIETUNG
 # -------------------------------------------------------------------
 @app.post("/vermietungen", response_model=s.VermietungOut)
-def create_vermietung(payload: s.VermietungBase, db: Session = Depends(get_db)):
+def create_vermietung(
+    payload: s.VermietungBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
     # Validierung (bis >= von) macht das Schema; hier nur persistieren
+    if idem.replay:
+        return idem.replay
     obj = m.Vermietung(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.VermietungOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/vermietungen", response_model=List[s.VermietungOut])
-def list_vermietungen(db: Session = Depends(get_db)):
-    return db.query(m.Vermietung).order_by(m.Vermietung.id.desc()).all()
+@app.get("/vermietungen", response_model=List[s.VermietungOut], response_class=VerhandeltesJSON)
+def list_vermietungen(firma_id: Optional[int] = Query(None), db: Session = Depends(get_db)):
+    q = db.query(m.Vermietung)
+    if firma_id:
+        q = q.join(m.Geraet, m.Geraet.id == m.Vermietung.geraet_id).filter(m.Geraet.firma_id == firma_id)
+    return q.order_by(m.Vermietung.id.desc()).all()
 
 
-@app.post("/vermietungen/{vermietung_id}/starten", response_model=s.VermietungOut)
-def starten(vermietung_id: int, db: Session = Depends(get_db)):
-    v = db.get(m.Vermietung, vermietung_id)
+def _lock_vermietung(db: Session, vermietung_id: int) -> m.Vermietung:
+    """
+    Lädt Vermietung + Gerät in EINER Abfrage und sperrt beide Zeilen (SELECT ... FOR UPDATE).
+    Parallele Statuswechsel auf derselben Vermietung bzw. demselben Gerät laufen damit
+    nacheinander und sehen jeweils den festgeschriebenen Stand des Vorgängers.
+    """
+    stmt = (
+        select(m.Vermietung)
+        .options(joinedload(m.Vermietung.geraet, innerjoin=True))
+        .where(m.Vermietung.id == vermietung_id)
+        .with_for_update()
+    )
+    v = db.scalars(stmt).first()
     if not v:
         raise HTTPException(404, "Vermietung nicht gefunden")
+    return v
+
+
+def _andere_offene_vermietung(db: Session, v: m.Vermietung) -> bool:
+    stmt = select(m.Vermietung.id).where(
+        m.Vermietung.geraet_id == v.geraet_id,
+        m.Vermietung.status == s.VermietStatus.OFFEN,
+        m.Vermietung.id != v.id,
+    ).limit(1)
+    return db.scalar(stmt) is not None
+
+
+@app.post("/vermietungen/{vermietung_id}/starten", response_model=s.VermietungOut)
+def starten(vermietung_id: int, db: Session = Depends(get_db)):
+    v = _lock_vermietung(db, vermietung_id)
+    if v.status == s.VermietStatus.OFFEN:
+        return v  # bereits gestartet
+    if v.status in (s.VermietStatus.GESCHLOSSEN, s.VermietStatus.STORNIERT):
+        db.rollback()
+        raise HTTPException(409, f"Vermietung ist {v.status.value} und kann nicht gestartet werden")
+    if _andere_offene_vermietung(db, v):
+        db.rollback()
+        raise HTTPException(409, "Gerät ist bereits in einer anderen offenen Vermietung")
     v.status = s.VermietStatus.OFFEN
     v.geraet.status = s.GeraetStatus.VERMIETET
     v.geraet.standort_typ = s.StandortTyp.KUNDE
+    protokolliere(db, v, m.EreignisAktion.GESTARTET)
+    protokolliere(db, v.geraet, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(v)
     return v
@@ -326,14 +588,23 @@ def starten(vermietung_id: int, db: Session = Depends(get_db)):
 def schliessen(vermietung_id: int, bis: Optional[date] = None, db: Session = Depends(get_db)):
     """
     Schließt eine Vermietung. Wenn `bis` nicht übergeben wird, wird das heutige Datum verwendet.
+    Das Gerät geht nur dann zurück in den Mietpark, wenn keine andere Vermietung darauf offen ist.
     """
-    v = db.get(m.Vermietung, vermietung_id)
-    if not v:
-        raise HTTPException(404, "Vermietung nicht gefunden")
+    v = _lock_vermietung(db, vermietung_id)
+    if v.status in (s.VermietStatus.GESCHLOSSEN, s.VermietStatus.STORNIERT):
+        db.rollback()
+        raise HTTPException(409, f"Vermietung ist bereits {v.status.value}")
+    bis = bis or date.today()  # Default: heute
+    if bis < v.von:
+        db.rollback()
+        raise HTTPException(400, "bis < von")
     v.status = s.VermietStatus.GESCHLOSSEN
-    v.bis = bis or date.today()  # Default: heute
-    v.geraet.status = s.GeraetStatus.VERFUEGBAR
-    v.geraet.standort_typ = s.StandortTyp.MIETPARK
+    v.bis = bis
+    protokolliere(db, v, m.EreignisAktion.GESCHLOSSEN)
+    if not _andere_offene_vermietung(db, v):
+        v.geraet.status = s.GeraetStatus.VERFUEGBAR
+        v.geraet.standort_typ = s.StandortTyp.MIETPARK
+        protokolliere(db, v.geraet, m.EreignisAktion.GEAENDERT)
     db.commit()
     db.refresh(v)
     return v
@@ -343,9 +614,17 @@ def schliessen(vermietung_id: int, bis: Optional[date] = None, db: Session = Dep
 # POSITIONEN
 # -------------------------------------------------------------------
 @app.post("/vermietung-positionen", response_model=s.VermietungPositionOut)
-def add_position(payload: s.VermietungPositionBase, db: Session = Depends(get_db)):
+def add_position(
+    payload: s.VermietungPositionBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.VermietungPosition(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.VermietungPositionOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
@@ -355,10 +634,21 @@ def add_position(payload: s.VermietungPositionBase, db: Session = Depends(get_db
 # RECHNUNG
 # -------------------------------------------------------------------
 @app.post("/rechnungen", response_model=s.RechnungOut)
-def create_rechnung(payload: s.RechnungBase, db: Session = Depends(get_db)):
+def create_rechnung(
+    payload: s.RechnungBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
+    # Nummern bleiben auch gegenüber archivierten Rechnungen eindeutig
+    if db.scalar(select(m.rechnungen_archiv.c.id).where(m.rechnungen_archiv.c.nummer == payload.nummer).limit(1)):
+        raise HTTPException(400, "Rechnungsnummer bereits vergeben")
     obj = m.Rechnung(**payload.dict())
     db.add(obj)
     try:
+        idem.speichern(obj, s.RechnungOut)
+        protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
         db.commit()
     except Exception:
         db.rollback()
@@ -367,7 +657,7 @@ def create_rechnung(payload: s.RechnungBase, db: Session = Depends(get_db)):
     return obj
 
 
-@app.get("/rechnungen/suche", response_model=List[s.RechnungOut])
+@app.get("/rechnungen/suche", response_model=List[s.RechnungOut], response_class=VerhandeltesJSON)
 def search_rechnungen(nummer: str, db: Session = Depends(get_db)):
     return db.query(m.Rechnung).filter(m.Rechnung.nummer.ilike(f"%{nummer}%")).all()
 
@@ -378,6 +668,7 @@ def toggle_rechnung_bezahlt(rechnung_id: int, bezahlt: bool, db: Session = Depen
     if not r:
         raise HTTPException(404, "Rechnung nicht gefunden")
     r.bezahlt = bezahlt
+    protokolliere(db, r, m.EreignisAktion.BEZAHLT)
     db.commit()
     db.refresh(r)
     return r
@@ -387,58 +678,292 @@ def toggle_rechnung_bezahlt(rechnung_id: int, bezahlt: bool, db: Session = Depen
 # WARTUNG / ZÄHLER
 # -------------------------------------------------------------------
 @app.post("/wartungen", response_model=s.WartungOut)
-def create_wartung(payload: s.WartungBase, db: Session = Depends(get_db)):
+def create_wartung(
+    payload: s.WartungBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Wartung(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.WartungOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
-@app.get("/wartungen", response_model=List[s.WartungOut])
+@app.get("/wartungen", response_model=List[s.WartungOut], response_class=VerhandeltesJSON)
 def list_wartungen(db: Session = Depends(get_db)):
     return db.query(m.Wartung).order_by(m.Wartung.datum.desc()).all()
 
 
+@app.get("/wartungen/faellig", response_model=List[s.WartungFaelligItem], response_class=VerhandeltesJSON)
+def list_wartungen_faellig(
+    vorlauf_tage: int = Query(0, ge=0),
+    vorlauf_stunden: float = Query(0.0, ge=0),
+    firma_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Fällige und überfällige Wartungen der ganzen Flotte. Mit `vorlauf_tage`/`vorlauf_stunden`
+    werden auch Geräte geliefert, die innerhalb dieses Vorlaufs fällig werden.
+    """
+    return wartungen_faellig(db, vorlauf_tage=vorlauf_tage, vorlauf_stunden=vorlauf_stunden, firma_id=firma_id)
+
+
+@app.post("/wartungsintervalle", response_model=s.WartungsintervallOut)
+def create_wartungsintervall(
+    payload: s.WartungsintervallBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
+    obj = m.Wartungsintervall(**payload.dict())
+    db.add(obj)
+    try:
+        idem.speichern(obj, s.WartungsintervallOut)
+        protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(400, "Für diese Kategorie ist bereits ein Intervall hinterlegt")
+    db.refresh(obj)
+    return obj
+
+
+@app.get("/wartungsintervalle", response_model=List[s.WartungsintervallOut], response_class=VerhandeltesJSON)
+def list_wartungsintervalle(db: Session = Depends(get_db)):
+    return db.query(m.Wartungsintervall).order_by(m.Wartungsintervall.kategorie).all()
+
+
+@app.put("/wartungsintervalle/{intervall_id}", response_model=s.WartungsintervallOut)
+def update_wartungsintervall(intervall_id: int, payload: s.WartungsintervallBase, db: Session = Depends(get_db)):
+    obj = db.get(m.Wartungsintervall, intervall_id)
+    if not obj:
+        raise HTTPException(404, "Wartungsintervall nicht gefunden")
+    for k, v in payload.dict().items():
+        setattr(obj, k, v)
+    protokolliere(db, obj, m.EreignisAktion.GEAENDERT)
+    db.commit()
+    db.refresh(obj)
+    return obj
+
+
+@app.delete("/wartungsintervalle/{intervall_id}", status_code=204)
+def delete_wartungsintervall(intervall_id: int, db: Session = Depends(get_db)):
+    obj = db.get(m.Wartungsintervall, intervall_id)
+    if not obj:
+        raise HTTPException(404, "Wartungsintervall nicht gefunden")
+    protokolliere(db, obj, m.EreignisAktion.GELOESCHT)
+    db.delete(obj)
+    db.commit()
+    return
+
+
 @app.post("/zaehlerstaende", response_model=s.ZaehlerstandOut)
-def create_zaehler(payload: s.ZaehlerstandBase, db: Session = Depends(get_db)):
+def create_zaehler(
+    payload: s.ZaehlerstandBase,
+    db: Session = Depends(get_db),
+    idem: Idempotenz = Depends(idempotenz),
+):
+    if idem.replay:
+        return idem.replay
     obj = m.Zaehlerstand(**payload.dict())
     db.add(obj)
+    idem.speichern(obj, s.ZaehlerstandOut)
+    protokolliere(db, obj, m.EreignisAktion.ERSTELLT)
     db.commit()
     db.refresh(obj)
     return obj
 
 
+# -------------------------------------------------------------------
+# PREISE
+# -------------------------------------------------------------------
+@app.post("/preise/angebot", response_model=s.AngebotResponse)
+def preise_angebot(req: s.AngebotRequest, db: Session = Depends(get_db)):
+    """Mietpreise inkl. Langzeitrabatt für viele (Gerät, von, bis) auf einmal; 422 bei unbekannten Geräten."""
+    try:
+        return angebot(db, req.positionen)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+
+
+# -------------------------------------------------------------------
+# EREIGNISSE (Änderungs-Feed)
+# -------------------------------------------------------------------
+@app.get("/events", response_model=s.EreignisFeed, response_class=VerhandeltesJSON)
+def list_events(
+    after: Optional[str] = Query(None, description="Cursor aus der vorherigen Antwort"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    """
+    Änderungen seit `after` in Commit-sicherer Reihenfolge. Ohne `after` ab Beginn des Protokolls;
+    ist `items` leer, bleibt der Cursor unverändert.
+    """
+    try:
+        return ereignisse_seit(db, after, limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.on_event("startup")
+async def startup_hintergrund() -> None:
+    await verteiler.start()
+    await planer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_hintergrund() -> None:
+    await verteiler.stop()
+    await planer.stop()
+
+
+@app.get("/events/stream")
+async def events_stream(
+    request: Request,
+    after: Optional[str] = Query(None, description="Cursor; alternativ Header Last-Event-ID"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events für Status-/Standortänderungen von Geräten und Vermietungen.
+    Bei `event: reset` ist der Stand nicht lückenlos nachholbar -> Listen einmal neu laden.
+    """
+    abo = verteiler.anmelden(last_event_id or after)
+    return StreamingResponse(
+        sse_strom(abo, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# -------------------------------------------------------------------
+# SYNC
+# -------------------------------------------------------------------
+@app.get("/sync", response_model=s.SyncResponse, response_class=VerhandeltesJSON)
+def sync(
+    since: Optional[str] = Query(None, description="Token aus der vorherigen Antwort; ohne = Vollabzug"),
+    limit: int = Query(SYNC_LIMIT, ge=1, le=10000, description="max. Ereignisse je Abruf"),
+    db: Session = Depends(get_db),
+):
+    """Geänderte Geräte, Vermietungen, Kunden, Rechnungen und Wartungen seit `since` plus Tombstones."""
+    try:
+        return sync_seit(db, since, limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+# -------------------------------------------------------------------
+# ARCHIV
+# -------------------------------------------------------------------
+@app.post("/archiv/ausfuehren", response_model=s.ArchivErgebnis)
+def archiv_ausfuehren(
+    stichtag: Optional[date] = Query(None, description="Vermietungen mit Ende davor; Default: vor 2 Jahren"),
+    batch: int = Query(ARCHIV_BATCH, ge=1, le=50000),
+    db: Session = Depends(get_db),
+):
+    """Verschiebt alte abgeschlossene Vermietungen und ausgemusterte Geräte ins Archiv."""
+    stichtag = stichtag or date.today() - timedelta(days=2 * 365)
+    return {"stichtag": stichtag, "verschoben": archivieren(db, stichtag, batch)}
+
+
 # -------------------------------------------------------------------
 # BERICHTE
 # -------------------------------------------------------------------
-@app.post("/berichte/auslastung", response_model=s.AuslastungResponse)
-def berichte_auslastung(req: s.AuslastungRequest, db: Session = Depends(get_db)):
+@app.post("/berichte/auslastung", response_model=s.AuslastungResponse, response_class=VerhandeltesJSON)
+def berichte_auslastung(
+    req: s.AuslastungRequest,
+    live: bool = Query(False, description="Snapshot ignorieren und live rechnen"),
+    db: Session = Depends(get_db),
+):
+    if not live and req.geraet_id is None and not req.mit_archiv:
+        snapshot = auslastung_snapshot(db, req.von, req.bis, req.firma_id)
+        if snapshot:
+            return snapshot
     try:
-        data = report_auslastung(db, req.von, req.bis, req.geraet_id)
+        data = report_auslastung(db, req.von, req.bis, req.geraet_id, req.firma_id, req.mit_archiv)
     except AssertionError:
         raise HTTPException(400, "Ungültiger Zeitraum")
     return data
 
 
-@app.get("/berichte/vermietungen/{vermietung_id}/abrechnung", response_model=s.AbrechnungResponse)
-def abrechnung(vermietung_id: int, db: Session = Depends(get_db)):
+@app.get("/berichte/snapshots", response_model=List[s.BerichtSnapshotInfo])
+def berichte_snapshots(db: Session = Depends(get_db)):
+    """Vorberechnete Berichte mit Berechnungszeitpunkt und -dauer."""
+    return snapshots_uebersicht(db)
+
+
+@app.post("/berichte/snapshots/berechnen")
+def berichte_snapshots_berechnen(db: Session = Depends(get_db)):
+    """Snapshots sofort neu rechnen (sonst macht das der Planer)."""
+    anzahl = snapshots_berechnen(db)
+    if not anzahl:
+        raise HTTPException(409, "Vorberechnung läuft bereits")
+    return {"berechnet": anzahl}
+
+
+@app.get("/berichte/kunden", response_model=s.KundenBerichtResponse, response_class=VerhandeltesJSON)
+def berichte_kunden(
+    von: date,
+    bis: date,
+    sortierung: str = Query("einnahmen", description="einnahmen|marge|miete|positionen|kosten|geraetetage|vermietungen"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=1000),
+    firma_id: Optional[int] = None,
+    mit_archiv: bool = False,
+    live: bool = Query(False, description="Snapshot ignorieren und live rechnen"),
+    db: Session = Depends(get_db),
+):
+    """Kunden-Ranking nach Umsatz/Marge/Gerätetagen (Top-N = limit, Paging über skip)."""
+    if not live and not mit_archiv:
+        snapshot = kunden_snapshot(db, von, bis, sortierung, skip, limit, firma_id)
+        if snapshot:
+            return snapshot
     try:
-        data = report_abrechnung(db, vermietung_id)
+        return report_kunden(db, von, bis, sortierung, skip, limit, firma_id, mit_archiv)
+    except AssertionError:
+        raise HTTPException(400, "Ungültiger Zeitraum")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.get(
+    "/berichte/vermietungen/{vermietung_id}/abrechnung",
+    response_model=s.AbrechnungResponse,
+    response_class=VerhandeltesJSON,
+)
+def abrechnung(
+    vermietung_id: int,
+    firma_id: Optional[int] = None,
+    mit_archiv: bool = False,
+    db: Session = Depends(get_db),
+):
+    try:
+        data = report_abrechnung(db, vermietung_id, firma_id, mit_archiv)
     except ValueError as e:
         raise HTTPException(400, str(e))
     return data
 
 
-@app.get("/berichte/geraete/{geraet_id}/finanzen", response_model=s.GeraetFinanzenResponse)
+@app.get(
+    "/berichte/geraete/{geraet_id}/finanzen",
+    response_model=s.GeraetFinanzenResponse,
+    response_class=VerhandeltesJSON,
+)
 def geraet_finanzen(
     geraet_id: int,
     von: Optional[date] = None,
     bis: Optional[date] = None,
+    firma_id: Optional[int] = None,
+    mit_archiv: bool = False,
     db: Session = Depends(get_db),
 ):
     try:
-        data = report_geraet_finanzen(db, geraet_id, von, bis)
+        data = report_geraet_finanzen(db, geraet_id, von, bis, firma_id, mit_archiv)
     except ValueError as e:
         raise HTTPException(404, str(e))
     return data
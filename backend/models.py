@@ -3,9 +3,10 @@ from datetime import date, datetime
 from enum import Enum
 from typing import Optional, List
 from sqlalchemy import (
-    String, Integer, Float, Date, DateTime, Boolean, ForeignKey, Enum as SAEnum,
-    UniqueConstraint, CheckConstraint, Text, Index
+    String, Integer, BigInteger, Float, Date, DateTime, Boolean, ForeignKey, Enum as SAEnum,
+    UniqueConstraint, CheckConstraint, Text, Index, JSON, text, Table, Column
 )
+from sqlalchemy.dialects.postgresql import DATERANGE, Range
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import Optional
 from datetime import date
@@ -13,6 +14,15 @@ from datetime import date
 class Base(DeclarativeBase):
     pass
 
+class Zeitstempel:
+    """
+    `updated_at` je Zeile (DB-Uhr, UTC); bei UPDATE per Trigger gesetzt (siehe ensure_columns), auch für
+    Massen-Updates. Nur für Clients in den Antworten, kein Index: /sync liest das Änderungsprotokoll.
+    """
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=text("timezone('UTC', now())")
+    )
+
 # ---------- Enums ----------
 class GeraetStatus(str, Enum):
     VERFUEGBAR = "VERFUEGBAR"
@@ -26,6 +36,7 @@ class StandortTyp(str, Enum):
 
 class SatzEinheit(str, Enum):
     TAEGLICH = "TAEGLICH"
+    WOECHENTLICH = "WOECHENTLICH"
     MONATLICH = "MONATLICH"
 
 class VermietStatus(str, Enum):
@@ -34,6 +45,15 @@ class VermietStatus(str, Enum):
     GESCHLOSSEN = "GESCHLOSSEN"
     STORNIERT = "STORNIERT"
 
+class EreignisAktion(str, Enum):
+    ERSTELLT = "ERSTELLT"
+    GEAENDERT = "GEAENDERT"
+    GELOESCHT = "GELOESCHT"
+    GESTARTET = "GESTARTET"
+    GESCHLOSSEN = "GESCHLOSSEN"
+    BEZAHLT = "BEZAHLT"
+    ARCHIVIERT = "ARCHIVIERT"
+
 class PosTyp(str, Enum):
     MONTAGE = "MONTAGE"
     ERSATZTEIL = "ERSATZTEIL"
@@ -42,7 +62,7 @@ class PosTyp(str, Enum):
     SONSTIGES = "SONSTIGES"
 
 # ---------- Entities ----------
-class Firma(Base):
+class Firma(Zeitstempel, Base):
     __tablename__ = "firmen"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(200), unique=True, nullable=False)
@@ -51,7 +71,7 @@ class Firma(Base):
 
     geraete: Mapped[List["Geraet"]] = relationship(back_populates="firma", cascade="all, delete")
 
-class Mietpark(Base):
+class Mietpark(Zeitstempel, Base):
     __tablename__ = "mietparks"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(200), unique=True, nullable=False)
@@ -59,7 +79,7 @@ class Mietpark(Base):
 
     geraete: Mapped[List["Geraet"]] = relationship(back_populates="mietpark")
 
-class Kunde(Base):
+class Kunde(Zeitstempel, Base):
     __tablename__ = "kunden"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(200), nullable=False, index=True)
@@ -73,7 +93,7 @@ class MietpreisEinheit(str, Enum):
     WOECHENTLICH = "WOECHENTLICH"
     MONATLICH = "MONATLICH"
 
-class Geraet(Base):
+class Geraet(Zeitstempel, Base):
     __tablename__ = "geraete"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -106,12 +126,14 @@ class Geraet(Base):
 
     __table_args__ = (
         Index("ix_geraete_status", "status"),
+        # Mandanten-Zugriffe: Listen/Zähler/Berichte je Firma
+        Index("ix_geraete_firma_status_id", "firma_id", "status", "id"),
         # optional:
         # Index("ix_geraete_sn", "seriennummer"),
         # Index("ix_geraete_vermietet_in", "vermietet_in"),
     )
 
-class Vermietung(Base):
+class Vermietung(Zeitstempel, Base):
     __tablename__ = "vermietungen"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -134,8 +156,9 @@ class Vermietung(Base):
     __table_args__ = (
         # Bei offenem Ende (bis IS NULL) zulassen, sonst bis >= von
         CheckConstraint("bis IS NULL OR bis >= von", name="ck_zeitraum_gueltig"),
+        Index("ix_vermietungen_geraet_von", "geraet_id", "von"),
     )
-class VermietungPosition(Base):
+class VermietungPosition(Zeitstempel, Base):
     __tablename__ = "vermietung_positionen"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     vermietung_id: Mapped[int] = mapped_column(ForeignKey("vermietungen.id"), nullable=False, index=True)
@@ -146,7 +169,7 @@ class VermietungPosition(Base):
 
     vermietung: Mapped["Vermietung"] = relationship(back_populates="positionen")
 
-class Rechnung(Base):
+class Rechnung(Zeitstempel, Base):
     __tablename__ = "rechnungen"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     vermietung_id: Mapped[int] = mapped_column(ForeignKey("vermietungen.id"), nullable=False, index=True)
@@ -158,7 +181,7 @@ class Rechnung(Base):
 
     __table_args__ = (UniqueConstraint("nummer", name="uq_rechnung_nummer"),)
 
-class Wartung(Base):
+class Wartung(Zeitstempel, Base):
     __tablename__ = "wartungen"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     geraet_id: Mapped[int] = mapped_column(ForeignKey("geraete.id"), nullable=False, index=True)
@@ -168,7 +191,12 @@ class Wartung(Base):
 
     geraet: Mapped["Geraet"] = relationship(back_populates="wartungen")
 
-class Zaehlerstand(Base):
+    __table_args__ = (
+        # letzte Wartung je Gerät (Wartungsplan)
+        Index("ix_wartungen_geraet_datum", "geraet_id", "datum"),
+    )
+
+class Zaehlerstand(Zeitstempel, Base):
     __tablename__ = "zaehlerstaende"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     geraet_id: Mapped[int] = mapped_column(ForeignKey("geraete.id"), nullable=False, index=True)
@@ -176,3 +204,110 @@ class Zaehlerstand(Base):
     stunden: Mapped[float] = mapped_column(Float, default=0.0)
 
     geraet: Mapped["Geraet"] = relationship(back_populates="zaehlerstaende")
+
+    __table_args__ = (
+        # letzter Zählerstand je Gerät (Wartungsplan)
+        Index("ix_zaehlerstaende_geraet_zeitpunkt", "geraet_id", "zeitpunkt"),
+    )
+
+class GeraetStatusHistorie(Base):
+    """
+    Status/Standort je Gerät mit Gültigkeitszeitraum [von, bis) in Tagen (Stand jeweils Tagesende).
+    Gepflegt per Trigger auf `geraete` (siehe ensure_columns); ohne Fremdschlüssel, damit die
+    Historie gelöschte/archivierte Geräte überdauert.
+    """
+    __tablename__ = "geraete_status_historie"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    geraet_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    firma_id: Mapped[Optional[int]] = mapped_column(Integer)
+    status: Mapped[GeraetStatus] = mapped_column(SAEnum(GeraetStatus), nullable=False)
+    standort_typ: Mapped[Optional[StandortTyp]] = mapped_column(SAEnum(StandortTyp))
+    mietpark_id: Mapped[Optional[int]] = mapped_column(Integer)
+    gueltig: Mapped[Range[date]] = mapped_column(DATERANGE, nullable=False)
+
+    __table_args__ = (
+        # Stichtagsabfrage: gueltig @> :am
+        Index("ix_geraete_status_historie_gueltig", "gueltig", postgresql_using="gist"),
+    )
+
+class Wartungsintervall(Zeitstempel, Base):
+    """Serviceintervall je Gerätekategorie: nach Betriebsstunden und/oder Tagen seit der letzten Wartung."""
+    __tablename__ = "wartungsintervalle"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kategorie: Mapped[str] = mapped_column(String(120), unique=True, nullable=False)
+    intervall_stunden: Mapped[Optional[float]] = mapped_column(Float)
+    intervall_tage: Mapped[Optional[int]] = mapped_column(Integer)
+
+    __table_args__ = (
+        CheckConstraint(
+            "intervall_stunden IS NOT NULL OR intervall_tage IS NOT NULL",
+            name="ck_wartungsintervall_gesetzt",
+        ),
+    )
+
+# ---------- Archiv ----------
+# Abgeschlossene Vermietungen (mit Positionen/Rechnungen) und ausgemusterte Geräte (mit Wartungen/
+# Zählerständen) werden aus den heißen Tabellen in *_archiv verschoben (siehe backend/archiv.py).
+# Spalten = Spalten der Quelltabelle (IDs bleiben erhalten) + archiviert_am; keine Fremdschlüssel.
+def _archiv_tabelle(quelle: Table, *index_spalten: str) -> Table:
+    name = f"{quelle.name}_archiv"
+    spalten = [
+        Column(c.name, c.type.copy(), primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+        for c in quelle.columns
+    ]
+    return Table(
+        name, Base.metadata, *spalten,
+        Column("archiviert_am", DateTime, nullable=False, server_default=text("timezone('UTC', now())")),
+        *[Index(f"ix_{name}_{sp}", sp) for sp in index_spalten],
+    )
+
+geraete_archiv = _archiv_tabelle(Geraet.__table__, "firma_id")
+vermietungen_archiv = _archiv_tabelle(Vermietung.__table__, "geraet_id", "kunde_id", "von")
+vermietung_positionen_archiv = _archiv_tabelle(VermietungPosition.__table__, "vermietung_id")
+rechnungen_archiv = _archiv_tabelle(Rechnung.__table__, "vermietung_id", "nummer")
+wartungen_archiv = _archiv_tabelle(Wartung.__table__, "geraet_id")
+zaehlerstaende_archiv = _archiv_tabelle(Zaehlerstand.__table__, "geraet_id")
+
+# ---------- Technisch ----------
+class IdempotenzSchluessel(Base):
+    """Gespeicherte Antwort zu einem `Idempotency-Key` (siehe backend/idempotenz.py)."""
+    __tablename__ = "idempotenz_schluessel"
+    schluessel: Mapped[str] = mapped_column(String(200), primary_key=True)
+    pfad: Mapped[str] = mapped_column(String(200), nullable=False)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)  # sha256 des Request-Bodys
+    status_code: Mapped[Optional[int]] = mapped_column(Integer)
+    antwort: Mapped[Optional[dict]] = mapped_column(JSON)
+    erstellt_am: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+class BerichtSnapshot(Base):
+    """
+    Vorberechneter Bericht (siehe backend/vorberechnung.py). `schluessel` = Bericht + kanonische
+    Parameter; `daten` ist die fertige Antwort (JSON, von Postgres per TOAST komprimiert).
+    """
+    __tablename__ = "bericht_snapshots"
+    schluessel: Mapped[str] = mapped_column(String(300), primary_key=True)
+    bericht: Mapped[str] = mapped_column(String(40), nullable=False)
+    daten: Mapped[dict] = mapped_column(JSON, nullable=False)
+    berechnet_am: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    dauer_ms: Mapped[float] = mapped_column(Float, nullable=False)
+    ereignis_stand: Mapped[Optional[str]] = mapped_column(String(50))  # Protokoll-Cursor beim Berechnen
+
+class Ereignis(Base):
+    """
+    Append-only Änderungsprotokoll (Outbox), geschrieben in derselben Transaktion wie die Änderung.
+    `txid` ist die Postgres-Transaktions-ID; der Feed ordnet nach (txid, id), siehe backend/ereignisse.py.
+    """
+    __tablename__ = "ereignisse"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    txid: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=text("txid_current()"))
+    zeitpunkt: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=text("timezone('UTC', now())")
+    )
+    entitaet: Mapped[str] = mapped_column(String(40), nullable=False)   # Tabellenname, z. B. "geraete"
+    entitaet_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    aktion: Mapped[str] = mapped_column(String(20), nullable=False)     # EreignisAktion
+    daten: Mapped[Optional[dict]] = mapped_column(JSON)                 # kompakte Kernfelder
+
+    __table_args__ = (
+        Index("ix_ereignisse_txid_id", "txid", "id"),
+    )
@@ -0,0 +1,90 @@
+# backend/preise.py
+"""
+Preisermittlung für Angebote (viele Geräte x viele Zeiträume in einem Aufruf).
+
+Je Mietpreis (Wert + Einheit) wird einmal eine Preistabelle für 1..TABELLE_TAGE Miettage
+vorberechnet (inkl. Langzeitrabatt) und per lru_cache gemerkt. Der Cache-Schlüssel ist der Preis
+selbst: ändert sich `mietpreis_wert`/`mietpreis_einheit` eines Geräts, greift automatisch eine neue
+Tabelle; Geräte mit gleichem Preis (typisch: gleiche Kategorie) teilen sich eine Tabelle.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models as m
+from .logic import calc_miete_for_zeitraum
+from .schemas import SatzEinheit
+from .utils.date_math import days_inclusive
+
+# Langzeitrabatt: (ab Miettagen, Rabatt in Prozent), aufsteigend
+RABATTSTAFFEL: tuple[tuple[int, float], ...] = (
+    (28, 5.0),
+    (90, 10.0),
+    (180, 15.0),
+)
+TABELLE_TAGE = 366
+
+
+def rabatt_prozent(tage: int) -> float:
+    rabatt = 0.0
+    for ab_tage, prozent in RABATTSTAFFEL:
+        if tage >= ab_tage:
+            rabatt = prozent
+    return rabatt
+
+
+def _preis(wert: float, einheit: SatzEinheit, tage: int) -> tuple[float, float]:
+    """(Grundpreis, Preis nach Rabatt) für `tage` Miettage."""
+    grund = calc_miete_for_zeitraum(wert, einheit, tage)
+    return round(grund, 2), round(grund * (1 - rabatt_prozent(tage) / 100.0), 2)
+
+
+@lru_cache(maxsize=1024)
+def preistabelle(wert: float, einheit: str) -> tuple[tuple[float, float], ...]:
+    """Index = Miettage (0..TABELLE_TAGE) -> (Grundpreis, Preis)."""
+    e = SatzEinheit(einheit)
+    return tuple(_preis(wert, e, t) for t in range(TABELLE_TAGE + 1))
+
+
+def angebot(db: Session, positionen: list) -> dict:
+    """
+    Preise für alle (geraet_id, von, bis); Gerätepreise werden in einer Abfrage geladen.
+    Unbekannte Geräte-IDs -> ValueError (alle auf einmal); `None`-Preise nur für Geräte ohne Mietpreis.
+    """
+    ids = {p.geraet_id for p in positionen}
+    stmt = select(m.Geraet.id, m.Geraet.mietpreis_wert, m.Geraet.mietpreis_einheit).where(m.Geraet.id.in_(ids))
+    saetze = {row.id: (row.mietpreis_wert, row.mietpreis_einheit) for row in db.execute(stmt)}
+    unbekannt = ids - saetze.keys()
+    if unbekannt:
+        raise ValueError(f"Unbekannte Geräte: {', '.join(map(str, sorted(unbekannt)))}")
+
+    items = []
+    summe = 0.0
+    for p in positionen:
+        tage = days_inclusive(p.von, p.bis)
+        wert, einheit = saetze[p.geraet_id]
+        grund: Optional[float] = None
+        preis: Optional[float] = None
+        rabatt: Optional[float] = None
+        if wert is not None and einheit is not None:
+            einheit = SatzEinheit(einheit)
+            if tage <= TABELLE_TAGE:
+                grund, preis = preistabelle(float(wert), einheit.value)[tage]
+            else:
+                grund, preis = _preis(float(wert), einheit, tage)
+            rabatt = rabatt_prozent(tage)
+            summe += preis
+        items.append({
+            "geraet_id": p.geraet_id,
+            "von": p.von,
+            "bis": p.bis,
+            "tage": tage,
+            "grundpreis": grund,
+            "rabatt_prozent": rabatt,
+            "preis": preis,
+        })
+    return {"items": items, "summe": round(summe, 2)}
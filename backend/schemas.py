@@ -5,7 +5,7 @@ from datetime import date, datetime
 from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel, field_validator, FieldValidationInfo, ConfigDict
+from pydantic import BaseModel, Field, field_validator, model_validator, FieldValidationInfo, ConfigDict
 
 
 # ---------- Enums ----------
@@ -72,6 +72,7 @@ class KundeBase(BaseModel):
 
 class KundeOut(KundeBase):
     id: int
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -101,9 +102,39 @@ class GeraetBase(BaseModel):
 
 class GeraetOut(GeraetBase):
     id: int
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
+class FacetteWert(BaseModel):
+    wert: Optional[str | int] = None  # None = ohne Wert (z. B. keine Kategorie)
+    anzahl: int
+
+
+class StatusStandortAnzahl(BaseModel):
+    status: GeraetStatus
+    standort_typ: StandortTyp
+    anzahl: int
+
+
+class GeraeteFacetten(BaseModel):
+    gesamt: int
+    status: List[FacetteWert]
+    standort_typ: List[FacetteWert]
+    kategorie: List[FacetteWert]
+    mietpark_id: List[FacetteWert]
+    firma_id: List[FacetteWert]
+    status_standort: List[StatusStandortAnzahl]
+
+
+class GeraetStandItem(BaseModel):
+    geraet_id: int
+    status: Optional[GeraetStatus] = None          # None = unbekannt
+    standort_typ: Optional[StandortTyp] = None
+    mietpark_id: Optional[int] = None
+    quelle: Optional[str] = None                   # HISTORIE | VERMIETUNGEN
+
+
 # ---------- Vermietung ----------
 class VermietungBase(BaseModel):
     geraet_id: int
@@ -125,6 +156,7 @@ class VermietungBase(BaseModel):
 
 class VermietungOut(VermietungBase):
     id: int
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -151,6 +183,7 @@ class RechnungBase(BaseModel):
 
 class RechnungOut(RechnungBase):
     id: int
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -163,9 +196,40 @@ class WartungBase(BaseModel):
 
 class WartungOut(WartungBase):
     id: int
+    updated_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
+class WartungsintervallBase(BaseModel):
+    kategorie: str
+    intervall_stunden: Optional[float] = None
+    intervall_tage: Optional[int] = None
+
+    @model_validator(mode="after")
+    def _check_intervall(self):
+        if self.intervall_stunden is None and self.intervall_tage is None:
+            raise ValueError("intervall_stunden oder intervall_tage angeben")
+        return self
+
+
+class WartungsintervallOut(WartungsintervallBase):
+    id: int
+    model_config = ConfigDict(from_attributes=True)
+
+
+class WartungFaelligItem(BaseModel):
+    geraet_id: int
+    name: str
+    kategorie: str
+    letzte_wartung: Optional[date] = None
+    stunden_aktuell: float
+    stunden_seit_wartung: float
+    tage_seit_wartung: Optional[int] = None
+    rest_stunden: Optional[float] = None  # negativ = überfällig
+    rest_tage: Optional[int] = None       # negativ = überfällig
+    ueberfaellig: bool
+
+
 class ZaehlerstandBase(BaseModel):
     geraet_id: int
     zeitpunkt: datetime
@@ -177,11 +241,86 @@ class ZaehlerstandOut(ZaehlerstandBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+# ---------- Preise / Angebot ----------
+class AngebotPosition(BaseModel):
+    geraet_id: int
+    von: date
+    bis: date
+
+    @field_validator("bis")
+    @classmethod
+    def _check_range(cls, v: date, info: FieldValidationInfo):
+        von = info.data.get("von")
+        if von is not None and v < von:
+            raise ValueError("bis < von")
+        return v
+
+
+class AngebotRequest(BaseModel):
+    positionen: List[AngebotPosition] = Field(..., min_length=1, max_length=10000)
+
+
+class AngebotItem(BaseModel):
+    geraet_id: int
+    von: date
+    bis: date
+    tage: int
+    grundpreis: Optional[float] = None  # None = Gerät ohne Mietpreis
+    rabatt_prozent: Optional[float] = None
+    preis: Optional[float] = None
+
+
+class AngebotResponse(BaseModel):
+    items: List[AngebotItem]
+    summe: float
+
+
+# ---------- Ereignisse ----------
+class EreignisOut(BaseModel):
+    id: int
+    zeitpunkt: datetime
+    entitaet: str
+    entitaet_id: int
+    aktion: str
+    daten: Optional[dict] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
+class EreignisFeed(BaseModel):
+    items: List[EreignisOut]
+    cursor: Optional[str] = None  # als ?after= für den nächsten Abruf
+
+
+# ---------- Sync ----------
+class SyncGeaendert(BaseModel):
+    geraete: List[GeraetOut] = []
+    vermietungen: List[VermietungOut] = []
+    kunden: List[KundeOut] = []
+    rechnungen: List[RechnungOut] = []
+    wartungen: List[WartungOut] = []
+
+
+class SyncResponse(BaseModel):
+    token: Optional[str] = None      # als ?since= für den nächsten Abruf
+    voll: bool                       # Vollabzug: lokales Replikat ersetzen statt mergen
+    mehr: bool                       # weitere Änderungen vorhanden -> sofort erneut abrufen
+    geaendert: SyncGeaendert         # neue/geänderte Zeilen (upserten)
+    geloescht: dict[str, List[int]]  # Tombstones je Entität (gelöscht oder archiviert)
+
+
+# ---------- Archiv ----------
+class ArchivErgebnis(BaseModel):
+    stichtag: date
+    verschoben: dict[str, int]  # Tabelle -> Anzahl Zeilen
+
+
 # ---------- Reports ----------
 class AuslastungRequest(BaseModel):
     von: date
     bis: date
     geraet_id: Optional[int] = None  # None = alle
+    firma_id: Optional[int] = None   # None = alle Firmen
+    mit_archiv: bool = False         # archivierte Vermietungen/Geräte einbeziehen
 
 
 class AuslastungItem(BaseModel):
@@ -194,6 +333,7 @@ class AuslastungItem(BaseModel):
 class AuslastungResponse(BaseModel):
     items: List[AuslastungItem]
     flotte_auslastung_prozent: float
+    stand: Optional[datetime] = None  # Zeitpunkt des Snapshots; None = live berechnet
 
 
 class AbrechnungResponse(BaseModel):
@@ -206,6 +346,32 @@ class AbrechnungResponse(BaseModel):
     marge: float
 
 
+class KundenBerichtItem(BaseModel):
+    kunde_id: int
+    name: str
+    anzahl_vermietungen: int
+    geraetetage: int            # vermietete Gerätetage im Zeitraum
+    miete_summe: float
+    positionen_summe: float
+    einnahmen: float
+    kosten_summe: float
+    marge: float
+
+
+class KundenBerichtResponse(BaseModel):
+    gesamt: int                 # Anzahl Kunden mit Vermietungen im Zeitraum (für Paging)
+    items: List[KundenBerichtItem]
+    stand: Optional[datetime] = None  # Zeitpunkt des Snapshots; None = live berechnet
+
+
+class BerichtSnapshotInfo(BaseModel):
+    schluessel: str
+    bericht: str
+    berechnet_am: datetime
+    dauer_ms: float
+    model_config = ConfigDict(from_attributes=True)
+
+
 class GeraetFinanzenResponse(BaseModel):
     geraet_id: int
     anzahl_vermietungen: int
@@ -215,3 +381,16 @@ class GeraetFinanzenResponse(BaseModel):
     tage_gesamt: int
     tage_vermietet: int
     auslastung_prozent: float
+
+
+# ---------- Gerätedetail ----------
+class VermietungMitPositionen(VermietungOut):
+    positionen: List[VermietungPositionOut] = []
+
+
+class GeraetDetail(BaseModel):
+    geraet: GeraetOut
+    vermietungen: List[VermietungMitPositionen]  # neueste zuerst, begrenzt
+    wartungen: List[WartungOut]                  # neueste zuerst, begrenzt
+    letzter_zaehlerstand: Optional[ZaehlerstandOut] = None
+    finanzen: GeraetFinanzenResponse
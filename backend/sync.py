@@ -0,0 +1,64 @@
+# backend/sync.py
+"""
+Delta-Sync für clientseitige Replikate.
+
+Token = Cursor des Änderungsprotokolls (`ereignisse`, siehe backend/ereignisse.py). Damit gilt
+dieselbe Garantie wie im Feed: keine Änderung geht zwischen zwei Sync-Aufrufen verloren, auch wenn
+Transaktionen in anderer Reihenfolge committen, als sie begonnen haben.
+
+- ohne `since`: Vollabzug aller Sync-Entitäten + Token (Kopf des Protokolls, *vor* dem Lesen
+  bestimmt; Änderungen dazwischen kommen beim nächsten Aufruf noch einmal, Clients upserten);
+- mit `since`: betroffene IDs aus den Ereignissen danach, deren aktuelle Zeilen in einer Abfrage je
+  Entität. Nicht mehr vorhandene Zeilen (gelöscht oder archiviert) kommen als Tombstone.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models as m
+from .ereignisse import ereignisse_kopf, ereignisse_seit
+
+SYNC_ENTITAETEN: dict[str, type] = {
+    "geraete": m.Geraet,
+    "vermietungen": m.Vermietung,
+    "kunden": m.Kunde,
+    "rechnungen": m.Rechnung,
+    "wartungen": m.Wartung,
+}
+SYNC_LIMIT = 2000
+
+
+def sync_seit(db: Session, since: Optional[str] = None, limit: int = SYNC_LIMIT):
+    geaendert: dict[str, list] = {e: [] for e in SYNC_ENTITAETEN}
+    geloescht: dict[str, list[int]] = {e: [] for e in SYNC_ENTITAETEN}
+
+    if not since:
+        token = ereignisse_kopf(db)
+        for entitaet, Model in SYNC_ENTITAETEN.items():
+            geaendert[entitaet] = db.scalars(select(Model).order_by(Model.id)).all()
+        return {"token": token, "voll": True, "mehr": False, "geaendert": geaendert, "geloescht": geloescht}
+
+    seite = ereignisse_seit(db, since, limit)
+    ids: dict[str, set[int]] = {e: set() for e in SYNC_ENTITAETEN}
+    for e in seite["items"]:
+        if e.entitaet in ids:
+            ids[e.entitaet].add(e.entitaet_id)
+
+    for entitaet, betroffen in ids.items():
+        if not betroffen:
+            continue
+        Model = SYNC_ENTITAETEN[entitaet]
+        zeilen = db.scalars(select(Model).where(Model.id.in_(betroffen)).order_by(Model.id)).all()
+        geaendert[entitaet] = zeilen
+        geloescht[entitaet] = sorted(betroffen - {z.id for z in zeilen})
+
+    return {
+        "token": seite["cursor"],
+        "voll": False,
+        "mehr": len(seite["items"]) == limit,
+        "geaendert": geaendert,
+        "geloescht": geloescht,
+    }
@@ -0,0 +1,155 @@
+# backend/tests/test_vermietung_concurrency.py
+"""
+Parallele Statuswechsel auf Vermietungen (starten/schliessen) gegen eine echte Postgres-Test-DB.
+
+Ausführen aus dem Repo-Wurzelverzeichnis:
+    TEST_DATABASE_URL=postgresql://... python -m pytest backend/tests
+Ohne TEST_DATABASE_URL wird übersprungen (die Zeilensperren lassen sich nicht mocken).
+"""
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL nicht gesetzt", allow_module_level=True)
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import delete, select  # noqa: E402
+
+from backend import main  # noqa: E402
+from backend import models as m  # noqa: E402
+from backend.database import SessionLocal, engine  # noqa: E402
+
+RUNDEN = 10
+PARALLEL = 8
+
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    m.Base.metadata.create_all(bind=engine)
+    main.ensure_columns()
+
+
+@pytest.fixture
+def client():
+    # ohne Kontextmanager: keine Startup-Hooks (Live-Verteiler, Planer) im Test
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def geraet():
+    """Firma + Kunde + Gerät im Mietpark; räumt samt Vermietungen wieder auf."""
+    with SessionLocal() as db:
+        firma = m.Firma(name=f"Test {uuid.uuid4()}")
+        kunde = m.Kunde(name="Testkunde")
+        db.add_all([firma, kunde])
+        db.flush()
+        g = m.Geraet(name="Testgerät", firma_id=firma.id)
+        db.add(g)
+        db.commit()
+        ids = {"geraet_id": g.id, "kunde_id": kunde.id, "firma_id": firma.id}
+    yield ids
+    with SessionLocal() as db:
+        db.execute(delete(m.Vermietung).where(m.Vermietung.geraet_id == ids["geraet_id"]))
+        db.execute(delete(m.Geraet).where(m.Geraet.id == ids["geraet_id"]))
+        db.execute(delete(m.Kunde).where(m.Kunde.id == ids["kunde_id"]))
+        db.execute(delete(m.Firma).where(m.Firma.id == ids["firma_id"]))
+        db.commit()
+
+
+def _vermietung(ids: dict, status: m.VermietStatus) -> int:
+    with SessionLocal() as db:
+        v = m.Vermietung(
+            geraet_id=ids["geraet_id"],
+            kunde_id=ids["kunde_id"],
+            von=date.today() - timedelta(days=3),
+            satz_wert=50.0,
+            satz_einheit=m.SatzEinheit.TAEGLICH,
+            status=status,
+        )
+        db.add(v)
+        if status == m.VermietStatus.OFFEN:
+            db.get(m.Geraet, ids["geraet_id"]).status = m.GeraetStatus.VERMIETET
+        db.commit()
+        return v.id
+
+
+def _parallel(client: TestClient, pfade: list[str]) -> list[int]:
+    """Alle POSTs möglichst gleichzeitig abfeuern; liefert die Statuscodes in Reihenfolge."""
+    start = threading.Barrier(len(pfade))
+
+    def aufruf(pfad: str) -> int:
+        start.wait()
+        return client.post(pfad).status_code
+
+    with ThreadPoolExecutor(max_workers=len(pfade)) as pool:
+        return list(pool.map(aufruf, pfade))
+
+
+def _pruefe_invariante(geraet_id: int) -> None:
+    """Höchstens eine offene Vermietung; solange eine offen ist, ist das Gerät nicht VERFUEGBAR."""
+    with SessionLocal() as db:
+        offen = db.scalars(
+            select(m.Vermietung.id).where(
+                m.Vermietung.geraet_id == geraet_id, m.Vermietung.status == m.VermietStatus.OFFEN
+            )
+        ).all()
+        status = db.get(m.Geraet, geraet_id).status
+    assert len(offen) <= 1
+    if offen:
+        assert status == m.GeraetStatus.VERMIETET
+    else:
+        assert status == m.GeraetStatus.VERFUEGBAR
+
+
+def _zuruecksetzen(geraet_id: int) -> None:
+    with SessionLocal() as db:
+        db.execute(delete(m.Vermietung).where(m.Vermietung.geraet_id == geraet_id))
+        db.get(m.Geraet, geraet_id).status = m.GeraetStatus.VERFUEGBAR
+        db.commit()
+
+
+def test_starten_zwei_reservierungen_gleiches_geraet(client, geraet):
+    for _ in range(RUNDEN):
+        a = _vermietung(geraet, m.VermietStatus.RESERVIERT)
+        b = _vermietung(geraet, m.VermietStatus.RESERVIERT)
+        codes = _parallel(client, [f"/vermietungen/{a}/starten", f"/vermietungen/{b}/starten"])
+        assert sorted(codes) == [200, 409]
+        _pruefe_invariante(geraet["geraet_id"])
+        _zuruecksetzen(geraet["geraet_id"])
+
+
+def test_schliessen_parallel(client, geraet):
+    for _ in range(RUNDEN):
+        v = _vermietung(geraet, m.VermietStatus.OFFEN)
+        codes = _parallel(client, [f"/vermietungen/{v}/schliessen"] * PARALLEL)
+        assert codes.count(200) == 1
+        assert codes.count(409) == PARALLEL - 1
+        _pruefe_invariante(geraet["geraet_id"])
+        _zuruecksetzen(geraet["geraet_id"])
+
+
+def test_schliessen_und_starten_parallel(client, geraet):
+    """
+    A ist offen, B reserviert (gleiches Gerät): schliessen(A) gewinnt immer; starten(B) gelingt nur,
+    wenn es nach dem Schließen läuft, sonst 409. Das Gerät ist nie VERFUEGBAR, solange etwas offen ist.
+    """
+    for _ in range(RUNDEN):
+        a = _vermietung(geraet, m.VermietStatus.OFFEN)
+        b = _vermietung(geraet, m.VermietStatus.RESERVIERT)
+        pfade = [f"/vermietungen/{a}/schliessen", f"/vermietungen/{b}/starten"] * (PARALLEL // 2)
+        codes = _parallel(client, pfade)
+        schliessen, starten = codes[0::2], codes[1::2]
+        assert schliessen.count(200) == 1 and schliessen.count(409) == len(schliessen) - 1
+        # starten(B) ist idempotent: nach dem ersten Erfolg liefern weitere Aufrufe 200
+        assert set(starten) <= {200, 409}
+        _pruefe_invariante(geraet["geraet_id"])
+        _zuruecksetzen(geraet["geraet_id"])
@@ -0,0 +1,355 @@
+# backend/tools/lasttest.py
+"""
+Lasttest für die Mietpark API: parallele Requests nach konfigurierbarem Mix, Auswertung je Route
+(Durchsatz, p50/p95/p99, Fehlerquote) und Vergleich mit einer gespeicherten Baseline.
+
+Ohne --url wird die App lokal per uvicorn gestartet (DATABASE_URL muss auf eine lokale Test-DB
+zeigen; --seed legt dort über die API Testdaten an).
+
+    DATABASE_URL=postgresql://localhost/mietpark_test \\
+        python -m backend.tools.lasttest --seed --dauer 60 --parallel 32 \\
+        --baseline lasttest_baseline.json
+
+Als Fehler zählt jede Antwort außerhalb der erwarteten Statuscodes (Standard: 2xx; Szenarien
+können z. B. 409 bei erwartbaren Konflikten zulassen), Verbindungsfehler und Nicht-JSON-Bodys.
+
+Exit-Code 1, wenn eine Route gegenüber der Baseline um mehr als --toleranz langsamer ist
+oder ihre Fehlerquote steigt. Mit --speichern wird das Ergebnis als neue Baseline geschrieben.
+Benötigt httpx (backend/requirements-dev.txt).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Container, Optional
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    sys.exit("httpx fehlt: pip install -r backend/requirements-dev.txt")
+
+# Szenario: misst einen oder mehrere Requests über Lauf.req
+Szenario = Callable[["Lauf", httpx.AsyncClient], Awaitable[None]]
+
+ERFOLG = range(200, 300)
+
+
+class Lauf:
+    def __init__(self) -> None:
+        self.latenzen: dict[str, list[float]] = defaultdict(list)
+        self.fehler: dict[str, int] = defaultdict(int)
+        self.geraete: list[int] = []
+        self.kunden: list[int] = []
+        self.firmen: list[int] = []
+
+    async def req(
+        self,
+        client: httpx.AsyncClient,
+        route: str,
+        method: str,
+        url: str,
+        erwartet: Container[int] = ERFOLG,
+        **kw,
+    ) -> Optional[dict]:
+        """
+        Request messen; `route` ist das Label (Pfad-Template), nicht die konkrete URL.
+        Status außerhalb von `erwartet` zählt als Fehler; Daten gibt es nur bei 2xx mit JSON-Body.
+        """
+        t0 = time.perf_counter()
+        try:
+            r = await client.request(method, url, **kw)
+        except httpx.HTTPError:
+            r = None
+        self.latenzen[route].append(time.perf_counter() - t0)
+        if r is None or r.status_code not in erwartet:
+            self.fehler[route] += 1
+            return None
+        if r.status_code not in ERFOLG or not r.content:
+            return None
+        try:
+            return r.json()
+        except ValueError:
+            self.fehler[route] += 1
+            return None
+
+
+# ---------- Szenarien ----------
+async def s_geraete_liste(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    params = {"skip": random.randint(0, 200), "limit": 50}
+    if random.random() < 0.5:
+        params["status"] = random.choice(["VERFUEGBAR", "VERMIETET", "WARTUNG"])
+    await lauf.req(c, "GET /geraete", "GET", "/geraete", params=params)
+
+
+async def s_geraete_count(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    await lauf.req(c, "GET /geraete/count", "GET", "/geraete/count", params={"status": "VERFUEGBAR"})
+
+
+async def s_facets(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    await lauf.req(c, "GET /geraete/facets", "GET", "/geraete/facets")
+
+
+async def s_vermietungen_liste(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    await lauf.req(c, "GET /vermietungen", "GET", "/vermietungen")
+
+
+async def s_geraet_crud(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    body = _geraet_body(random.choice(lauf.firmen))
+    g = await lauf.req(c, "POST /geraete", "POST", "/geraete", json=body)
+    if g:
+        body["stundenzähler"] = random.uniform(0, 5000)
+        await lauf.req(c, "PUT /geraete/{id}", "PUT", f"/geraete/{g['id']}", json=body)
+        lauf.geraete.append(g["id"])
+
+
+async def s_vermietung_zyklus(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    von = date.today() - timedelta(days=random.randint(0, 60))
+    v = await lauf.req(c, "POST /vermietungen", "POST", "/vermietungen", json={
+        "geraet_id": random.choice(lauf.geraete),
+        "kunde_id": random.choice(lauf.kunden),
+        "von": von.isoformat(),
+        "satz_wert": 80.0,
+        "satz_einheit": "TAEGLICH",
+    })
+    if not v:
+        return
+    # 409: Gerät ist gerade in einem parallelen Zyklus vermietet -> erwartbar, kein Fehler
+    await lauf.req(
+        c, "POST /vermietungen/{id}/starten", "POST", f"/vermietungen/{v['id']}/starten", erwartet={200, 409}
+    )
+    await lauf.req(c, "POST /vermietungen/{id}/schliessen", "POST", f"/vermietungen/{v['id']}/schliessen")
+
+
+async def s_bericht_auslastung(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    bis = date.today()
+    await lauf.req(c, "POST /berichte/auslastung", "POST", "/berichte/auslastung", json={
+        "von": (bis - timedelta(days=30)).isoformat(), "bis": bis.isoformat(),
+    })
+
+
+async def s_bericht_finanzen(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    gid = random.choice(lauf.geraete)
+    await lauf.req(c, "GET /berichte/geraete/{id}/finanzen", "GET", f"/berichte/geraete/{gid}/finanzen")
+
+
+async def s_wartungen_faellig(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    await lauf.req(c, "GET /wartungen/faellig", "GET", "/wartungen/faellig")
+
+
+SZENARIEN: dict[str, Szenario] = {
+    "geraete_liste": s_geraete_liste,
+    "geraete_count": s_geraete_count,
+    "facets": s_facets,
+    "vermietungen_liste": s_vermietungen_liste,
+    "geraet_crud": s_geraet_crud,
+    "vermietung_zyklus": s_vermietung_zyklus,
+    "bericht_auslastung": s_bericht_auslastung,
+    "bericht_finanzen": s_bericht_finanzen,
+    "wartungen_faellig": s_wartungen_faellig,
+}
+
+STANDARD_MIX: dict[str, int] = {
+    "geraete_liste": 30,
+    "geraete_count": 10,
+    "facets": 10,
+    "vermietungen_liste": 10,
+    "geraet_crud": 10,
+    "vermietung_zyklus": 10,
+    "bericht_auslastung": 5,
+    "bericht_finanzen": 10,
+    "wartungen_faellig": 5,
+}
+
+
+# ---------- Testdaten ----------
+def _geraet_body(firma_id: int) -> dict:
+    return {
+        "name": f"Lasttest {uuid.uuid4().hex[:8]}",
+        "kategorie": random.choice(["Bagger", "Radlader", "Walze", "Stapler"]),
+        "firma_id": firma_id,
+        "mietpreis_wert": random.choice([60.0, 80.0, 120.0]),
+        "mietpreis_einheit": "TAEGLICH",
+    }
+
+
+async def seeden(lauf: Lauf, c: httpx.AsyncClient, geraete: int, kunden: int) -> None:
+    kennung = uuid.uuid4().hex[:6]
+    for i in range(3):
+        r = await c.post("/firmen", json={"name": f"Lasttest-Firma {kennung}-{i}"})
+        r.raise_for_status()
+        lauf.firmen.append(r.json()["id"])
+    sem = asyncio.Semaphore(16)
+
+    async def post(url: str, body: dict, ziel: list[int]) -> None:
+        async with sem:
+            r = await c.post(url, json=body)
+            r.raise_for_status()
+            ziel.append(r.json()["id"])
+
+    await asyncio.gather(*[
+        post("/kunden", {"name": f"Lasttest-Kunde {kennung}-{i}"}, lauf.kunden) for i in range(kunden)
+    ])
+    await asyncio.gather(*[
+        post("/geraete", _geraet_body(random.choice(lauf.firmen)), lauf.geraete) for _ in range(geraete)
+    ])
+
+
+async def _vorhandene_laden(lauf: Lauf, c: httpx.AsyncClient) -> None:
+    lauf.firmen = [f["id"] for f in (await c.get("/firmen")).json()]
+    lauf.kunden = [k["id"] for k in (await c.get("/kunden")).json()]
+    lauf.geraete = [g["id"] for g in (await c.get("/geraete", params={"limit": 1000})).json()]
+    if not (lauf.firmen and lauf.kunden and lauf.geraete):
+        sys.exit("Keine Testdaten vorhanden: mit --seed starten")
+
+
+# ---------- Lauf ----------
+async def ausfuehren(url: str, mix: dict[str, int], dauer: float, parallel: int, seed: bool) -> tuple[Lauf, float]:
+    lauf = Lauf()
+    limits = httpx.Limits(max_connections=parallel, max_keepalive_connections=parallel)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as c:
+        if seed:
+            await seeden(lauf, c, geraete=200, kunden=50)
+        else:
+            await _vorhandene_laden(lauf, c)
+
+        namen = list(mix)
+        gewichte = [mix[n] for n in namen]
+        ende = time.perf_counter() + dauer
+
+        async def arbeiter() -> None:
+            while time.perf_counter() < ende:
+                name = random.choices(namen, gewichte)[0]
+                await SZENARIEN[name](lauf, c)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[arbeiter() for _ in range(parallel)])
+        return lauf, time.perf_counter() - t0
+
+
+def _perzentil(sortiert: list[float], p: float) -> float:
+    if not sortiert:
+        return 0.0
+    # Nearest-Rank
+    idx = max(0, math.ceil(p / 100.0 * len(sortiert)) - 1)
+    return sortiert[idx]
+
+
+def auswerten(lauf: Lauf, dauer: float) -> dict[str, dict[str, float]]:
+    res = {}
+    for route, werte in sorted(lauf.latenzen.items()):
+        werte = sorted(werte)
+        res[route] = {
+            "anzahl": len(werte),
+            "rps": round(len(werte) / dauer, 2),
+            "p50_ms": round(_perzentil(werte, 50) * 1000, 2),
+            "p95_ms": round(_perzentil(werte, 95) * 1000, 2),
+            "p99_ms": round(_perzentil(werte, 99) * 1000, 2),
+            "fehlerquote": round(lauf.fehler[route] / len(werte), 4),
+        }
+    return res
+
+
+def ausgeben(ergebnis: dict[str, dict[str, float]]) -> None:
+    print(f"{'Route':<42}{'n':>7}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Fehler':>9}")
+    for route, r in ergebnis.items():
+        print(
+            f"{route:<42}{r['anzahl']:>7}{r['rps']:>9.1f}{r['p50_ms']:>10.1f}"
+            f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['fehlerquote'] * 100:>8.2f}%"
+        )
+
+
+def vergleichen(ergebnis: dict, baseline: dict, toleranz: float) -> list[str]:
+    """Regressionen gegenüber der Baseline (leer = ok)."""
+    probleme = []
+    for route, alt in baseline.items():
+        neu = ergebnis.get(route)
+        if not neu:
+            continue
+        for k in ("p95_ms", "p99_ms"):
+            if alt[k] > 0 and neu[k] > alt[k] * (1 + toleranz):
+                probleme.append(f"{route}: {k} {alt[k]:.1f} -> {neu[k]:.1f}")
+        if neu["fehlerquote"] > alt["fehlerquote"] + 0.01:
+            probleme.append(f"{route}: Fehlerquote {alt['fehlerquote']:.2%} -> {neu['fehlerquote']:.2%}")
+    return probleme
+
+
+# ---------- lokaler Server ----------
+def _server_starten(port: int):
+    import uvicorn
+
+    from backend.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    t = threading.Thread(target=server.run, daemon=True)
+    t.start()
+    while not server.started:
+        if not t.is_alive():
+            sys.exit("Server konnte nicht gestartet werden")
+        time.sleep(0.05)
+    return server, t
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="laufende API; ohne Angabe wird die App lokal gestartet")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--dauer", type=float, default=30.0, help="Sekunden")
+    ap.add_argument("--parallel", type=int, default=16, help="gleichzeitige virtuelle Clients")
+    ap.add_argument("--mix", help='JSON-Datei {"szenario": gewicht, ...}; Szenarien: ' + ", ".join(SZENARIEN))
+    ap.add_argument("--seed", action="store_true", help="Testdaten über die API anlegen")
+    ap.add_argument("--baseline", help="JSON-Baseline zum Vergleich")
+    ap.add_argument("--speichern", help="Ergebnis als JSON (neue Baseline) schreiben")
+    ap.add_argument("--toleranz", type=float, default=0.2, help="erlaubte Verschlechterung p95/p99 (0.2 = 20%%)")
+    args = ap.parse_args(argv)
+
+    mix = STANDARD_MIX
+    if args.mix:
+        with open(args.mix) as f:
+            mix = json.load(f)
+        unbekannt = set(mix) - set(SZENARIEN)
+        if unbekannt:
+            ap.error(f"unbekannte Szenarien: {', '.join(sorted(unbekannt))}")
+
+    server = None
+    url = args.url
+    if not url:
+        server, thread = _server_starten(args.port)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        lauf, dauer = asyncio.run(ausfuehren(url, mix, args.dauer, args.parallel, args.seed))
+    finally:
+        if server:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    ergebnis = auswerten(lauf, dauer)
+    ausgeben(ergebnis)
+    gesamt = sum(r["anzahl"] for r in ergebnis.values())
+    print(f"\n{gesamt} Requests in {dauer:.1f}s = {gesamt / dauer:.1f} req/s")
+
+    if args.speichern:
+        with open(args.speichern, "w") as f:
+            json.dump(ergebnis, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            probleme = vergleichen(ergebnis, json.load(f), args.toleranz)
+        if probleme:
+            print("\nRegressionen gegenüber Baseline:")
+            for p in probleme:
+                print(f"  - {p}")
+            return 1
+        print("\nKeine Regression gegenüber Baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
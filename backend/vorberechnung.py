@@ -0,0 +1,213 @@
+# backend/vorberechnung.py
+"""
+Vorberechnete Berichte für das Dashboard.
+
+Statt dass jeder Nutzer morgens dieselben schweren Abfragen auslöst, rechnet ein Planer pro Prozess
+die Standardberichte vor und legt sie in `bericht_snapshots` ab:
+- Auslastung und Kunden-Ranking (Top KUNDEN_TOP nach Einnahmen),
+- für gestern, Monat bis heute und Jahr bis heute,
+- für alle Firmen zusammen und je Firma.
+Die Finanzkennzahlen je Firma und Zeitraum (Einnahmen, Kosten, Marge) stecken im Kunden-Ranking.
+Abrechnung (je Vermietung) und Gerätefinanzen (je Gerät) werden nicht vorberechnet: beide sind
+Punktabfragen über einen Index, ein Snapshot je Vermietung bzw. Gerät wäre teurer als die Anfrage.
+
+Gerechnet wird täglich ab VORBERECHNUNG_STUNDE (Nebenzeit) und danach erneut, wenn seit dem
+letzten Lauf relevante Änderungen protokolliert wurden, frühestens nach MIN_ABSTAND. Ein
+Advisory-Lock verhindert parallele Läufe mehrerer Prozesse. Alle Zeitpunkte (`berechnet_am`,
+Fälligkeit) kommen wie bei den Idempotency-Keys von der DB-Uhr in UTC, nicht von der App-Uhr:
+mehrere Prozesse vergleichen so nie Zeitstempel verschiedener Uhren.
+
+Nebenbei räumt der Planer bei jedem Durchlauf abgelaufene Idempotency-Keys auf.
+
+Die Berichts-Endpunkte liefern einen Snapshot, wenn die Parameter passen, samt `stand`
+(Berechnungszeitpunkt); sonst oder mit `live=true` wird wie bisher live gerechnet.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models as m
+from .database import SessionLocal
+from .ereignisse import aenderungen_seit, ereignisse_kopf
+from .idempotenz import idempotenz_aufraeumen
+from .logic import report_auslastung, report_kunden
+
+log = logging.getLogger(__name__)
+
+VORBERECHNUNG_STUNDE = 4  # UTC
+PRUEF_SEKUNDEN = 300
+MIN_ABSTAND = timedelta(minutes=30)
+RELEVANTE_ENTITAETEN = ("vermietungen", "vermietung_positionen", "geraete")
+KUNDEN_TOP = 50
+_LOCK_ID = 0x42657269  # pg_try_advisory_xact_lock
+
+
+def zeitraeume(heute: date) -> dict[str, tuple[date, date]]:
+    gestern = heute - timedelta(days=1)
+    return {
+        "gestern": (gestern, gestern),
+        "monat": (heute.replace(day=1), heute),
+        "jahr": (heute.replace(month=1, day=1), heute),
+    }
+
+
+def _db_jetzt(db: Session) -> datetime:
+    """Transaktionsbeginn laut DB, UTC ohne Zeitzone (wie `idempotenz_keys.erstellt_am`)."""
+    return db.scalar(select(func.timezone("UTC", func.now())))
+
+
+def schluessel(bericht: str, **parameter: Any) -> str:
+    return bericht + ":" + json.dumps(parameter, sort_keys=True, default=str, separators=(",", ":"))
+
+
+# ---------- Lesen ----------
+def snapshot_lesen(db: Session, bericht: str, **parameter: Any) -> Optional[m.BerichtSnapshot]:
+    return db.get(m.BerichtSnapshot, schluessel(bericht, **parameter))
+
+
+def auslastung_snapshot(db: Session, von: date, bis: date, firma_id: Optional[int]) -> Optional[dict]:
+    snap = snapshot_lesen(db, "auslastung", von=von, bis=bis, firma_id=firma_id)
+    return {**snap.daten, "stand": snap.berechnet_am} if snap else None
+
+
+def kunden_snapshot(
+    db: Session, von: date, bis: date, sortierung: str, skip: int, limit: int, firma_id: Optional[int]
+) -> Optional[dict]:
+    """Vorberechnet sind die Top KUNDEN_TOP nach Einnahmen; jede Seite darin wird daraus geschnitten."""
+    if sortierung != "einnahmen" or skip + limit > KUNDEN_TOP:
+        return None
+    snap = snapshot_lesen(db, "kunden", von=von, bis=bis, firma_id=firma_id)
+    if not snap:
+        return None
+    return {
+        "gesamt": snap.daten["gesamt"],
+        "items": snap.daten["items"][skip:skip + limit],
+        "stand": snap.berechnet_am,
+    }
+
+
+def snapshots_uebersicht(db: Session):
+    S = m.BerichtSnapshot
+    return db.execute(
+        select(S.schluessel, S.bericht, S.berechnet_am, S.dauer_ms).order_by(S.bericht, S.schluessel)
+    ).all()
+
+
+# ---------- Berechnen ----------
+def _berechnen(db: Session, heute: date) -> list[tuple[str, str, dict, float]]:
+    """Alle Standard-Berichte rechnen, nur lesend: (schluessel, bericht, daten, dauer_ms)."""
+    firmen = [None, *db.scalars(select(m.Firma.id).order_by(m.Firma.id))]
+    ergebnisse = []
+    for firma_id in firmen:
+        for von, bis in zeitraeume(heute).values():
+            t = time.perf_counter()
+            daten = report_auslastung(db, von, bis, None, firma_id)
+            ergebnisse.append((schluessel("auslastung", von=von, bis=bis, firma_id=firma_id), "auslastung",
+                               daten, (time.perf_counter() - t) * 1000))
+
+            t = time.perf_counter()
+            daten = report_kunden(db, von, bis, "einnahmen", 0, KUNDEN_TOP, firma_id)
+            ergebnisse.append((schluessel("kunden", von=von, bis=bis, firma_id=firma_id), "kunden",
+                               daten, (time.perf_counter() - t) * 1000))
+    return ergebnisse
+
+
+def snapshots_berechnen(db: Session, heute: Optional[date] = None) -> int:
+    """
+    Alle Standard-Snapshots neu rechnen; liefert die Anzahl, 0 = anderer Lauf aktiv.
+
+    Erst wird alles nur lesend gerechnet, dann in einem kurzen Schreibteil gespeichert: Postgres
+    vergibt die Transaktions-ID erst beim ersten Schreiben. Solange sie läuft, hält sie das xmin
+    des Änderungsprotokolls zurück; /events, /sync und der Live-Verteiler stehen also nur für die
+    Dauer des Schreibteils, nicht für die ganze Berechnung.
+    """
+    if not db.scalar(select(func.pg_try_advisory_xact_lock(_LOCK_ID))):
+        return 0
+    stand = ereignisse_kopf(db)  # vor dem Rechnen: Änderungen währenddessen lösen den nächsten Lauf aus
+    ergebnisse = _berechnen(db, heute or date.today())
+
+    beginn = _db_jetzt(db)
+    for schl, bericht, daten, dauer_ms in ergebnisse:
+        werte = {
+            "bericht": bericht,
+            "daten": daten,
+            "berechnet_am": beginn,
+            "dauer_ms": round(dauer_ms, 1),
+            "ereignis_stand": stand,
+        }
+        stmt = insert(m.BerichtSnapshot).values(schluessel=schl, **werte)
+        db.execute(stmt.on_conflict_do_update(index_elements=["schluessel"], set_=werte))
+    # Snapshots alter Zeiträume/gelöschter Firmen passen zu keiner Anfrage mehr
+    db.execute(delete(m.BerichtSnapshot).where(m.BerichtSnapshot.berechnet_am < beginn))
+    db.commit()
+    return len(ergebnisse)
+
+
+# ---------- Planer ----------
+class Planer:
+    def __init__(self) -> None:
+        self.letzter_lauf: Optional[datetime] = None
+        self.stand: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._schleife())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _schleife(self) -> None:
+        while True:
+            for aufgabe in (self._pruefen, self._aufraeumen):
+                try:
+                    await run_in_threadpool(aufgabe)
+                except Exception:
+                    log.exception("Hintergrundaufgabe %s fehlgeschlagen", aufgabe.__name__)
+            await asyncio.sleep(PRUEF_SEKUNDEN)
+
+    @staticmethod
+    def _aufraeumen() -> None:
+        with SessionLocal() as db:
+            idempotenz_aufraeumen(db)
+
+    def _pruefen(self) -> None:
+        with SessionLocal() as db:
+            # jedes Mal aus der Tabelle: ein anderer Prozess kann inzwischen gerechnet haben
+            self._stand_laden(db)
+            if not self._faellig(db, _db_jetzt(db)):
+                return
+            t = time.perf_counter()
+            anzahl = snapshots_berechnen(db)
+            if anzahl:
+                log.info("%d Bericht-Snapshots in %.0f ms berechnet", anzahl, (time.perf_counter() - t) * 1000)
+
+    def _stand_laden(self, db: Session) -> None:
+        S = m.BerichtSnapshot
+        row = db.execute(
+            select(S.berechnet_am, S.ereignis_stand).order_by(S.berechnet_am.desc()).limit(1)
+        ).first()
+        if row:
+            self.letzter_lauf, self.stand = row.berechnet_am, row.ereignis_stand
+
+    def _faellig(self, db: Session, jetzt: datetime) -> bool:
+        if self.letzter_lauf is None:
+            return True
+        if self.letzter_lauf.date() < jetzt.date() and jetzt.hour >= VORBERECHNUNG_STUNDE:
+            return True
+        if jetzt - self.letzter_lauf < MIN_ABSTAND:
+            return False
+        return aenderungen_seit(db, self.stand, RELEVANTE_ENTITAETEN)
+
+
+planer = Planer()